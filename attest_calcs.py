@@ -56,8 +56,8 @@ def get_attest_status(membership: memberdata.Membership,
     """
     Return True if the attestation matches the membership record
     """                      
-    members = membership.get_members_for_account_num(attest.account_num)
-    count = len(list(filter(lambda x : not x.is_caretaker_type(), members)))
+    household = membership.get_household(attest.account_num)
+    count = len(household.members) - len(household.caretakers)
     return count == len(attest.people)
     
     
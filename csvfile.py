@@ -5,6 +5,7 @@ TODO:
   - consider creating a base class for records stored as CSV rows
 """
 
+import hashlib
 import re
 import os
 
@@ -43,6 +44,21 @@ def backup_file(filename: str) -> bool:
         os.rename(filename, backup_names[0])
     return True
 
+def hash_files(filenames: list[str]) -> str:
+    """
+    Return a hex digest of the contents of a set of files.
+    Missing files are included in the digest as missing.
+    """
+    digest = hashlib.sha256()
+    for filename in filenames:
+        digest.update(filename.encode())
+        if not os.path.exists(filename):
+            digest.update(b"<missing>")
+            continue
+        with open(filename, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
 def is_signed(field_val: str) -> bool:
     return len(field_val) > 0 and field_val.lower()[0] == 'y'
 
@@ -0,0 +1,212 @@
+"""
+Download and parse new PDF documents concurrently.
+
+Downloads from Google Drive overlap in a pool of threads, each with its own
+Drive service. The downloaded documents are parsed by pdfplumber in a pool of
+processes. Results are returned in the order of the file list, so records are
+appended in the same order as when the documents were processed one by one.
+At most a window of documents is in progress at once.
+
+With a parse cache, documents whose content was parsed before by the same
+parser version are taken from the cache without downloading them. Files
+without a checksum in the Drive listing are looked up in the cache by the
+hash of the downloaded content instead. Files
+already recorded or with the same content as a recorded file are selected out
+by new_files before downloading.
+"""
+
+from __future__ import annotations
+
+import io
+import collections
+import concurrent.futures
+from typing import Callable, Iterator, TypeVar
+
+import gdrive
+import instrument
+import parse_cache
+
+
+# Threads downloading from Google Drive
+download_workers: int = 4
+# Processes parsing PDFs, 0 to parse in the download threads
+parse_workers: int = 2
+
+T = TypeVar("T")
+
+
+def download_data(file_id: str) -> bytes:
+    return gdrive.download_file(gdrive.thread_drive(), file_id).getvalue()
+
+
+def parse_bytes(parse: Callable[[io.BytesIO], T], data: bytes) -> T:
+    """
+    Parse a downloaded document, runs in a worker process
+    """
+    return parse(io.BytesIO(data))
+
+
+def file_hash(file: dict, data: bytes) -> str:
+    """
+    Content hash of a downloaded file, from the Drive listing if it has one
+    """
+    return file.get("sha256Checksum") or parse_cache.content_hash(data)
+
+
+def new_files(files: list[dict], names: set[str], links: set[str]) -> list[dict]:
+    """
+    Return the Drive files without a record, matched by file name or by link,
+    which stays the same when a file is renamed. A file with the same content
+    as a file with a record or as an earlier new file is a copy and is skipped.
+    """
+    known = { file["sha256Checksum"] for file in files
+              if "sha256Checksum" in file and (file["name"] in names or file["webViewLink"] in links) }
+    result = []
+    for file in files:
+        if file["name"] in names or file["webViewLink"] in links:
+            continue
+        if "sha256Checksum" in file:
+            if file["sha256Checksum"] in known:
+                print(f"Note: {file['name']} has the same content as another file - skipping")
+                instrument.count("download_pdfs.copies")
+                continue
+            known.add(file["sha256Checksum"])
+        result.append(file)
+    return result
+
+
+def copy_result(source: concurrent.futures.Future, result: concurrent.futures.Future) -> None:
+    exception = source.exception()
+    if exception is not None:
+        result.set_exception(exception)
+    else:
+        result.set_result(source.result())
+
+
+def download_and_parse(files: list[dict], parse: Callable[[io.BytesIO], T],
+                       cache: parse_cache.ParseCache[T] | None = None) -> Iterator[tuple[dict, T]]:
+    """
+    Download and parse the Drive files, yielding each file with its parsed document
+    in the order of the list. Documents that fail are reported and skipped.
+    parse must be a module level function so it can be sent to the worker processes.
+    Documents are read from and saved to the cache if one is given.
+    """
+    window = 2 * (download_workers + parse_workers)
+    parsers = concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 0 else None
+
+    # Content hash of each document downloaded, by file id
+    hashes: dict[str, str] = {}
+
+    def start(downloads: concurrent.futures.ThreadPoolExecutor, file: dict) -> concurrent.futures.Future:
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        if cache is not None and "sha256Checksum" in file:
+            document = cache.get(file["sha256Checksum"])
+            if document is not None:
+                instrument.count("download_pdfs.cached")
+                result.set_result(document)
+                return result
+
+        def downloaded(download: concurrent.futures.Future) -> None:
+            try:
+                data = download.result()
+                if cache is not None:
+                    sha256 = file_hash(file, data)
+                    if "sha256Checksum" not in file:
+                        # Not found before the download without a checksum
+                        document = cache.get(sha256)
+                        if document is not None:
+                            instrument.count("download_pdfs.cached")
+                            result.set_result(document)
+                            return
+                    hashes[file["id"]] = sha256
+                if parsers is None:
+                    result.set_result(parse_bytes(parse, data))
+                else:
+                    parsers.submit(parse_bytes, parse, data).add_done_callback(
+                        lambda parsed: copy_result(parsed, result))
+            except Exception as e:
+                result.set_exception(e)
+
+        downloads.submit(download_data, file["id"]).add_done_callback(downloaded)
+        return result
+
+    def finish(file: dict, result: concurrent.futures.Future) -> Iterator[tuple[dict, T]]:
+        try:
+            parsed = result.result()
+        except Exception as e:
+            print(f"Error: unable to process {file['name']}: {e}")
+            instrument.count("download_pdfs.failed")
+            return
+        instrument.count("download_pdfs.parsed")
+        if cache is not None and file["id"] in hashes:
+            cache.put(hashes.pop(file["id"]), parsed)
+        yield file, parsed
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=download_workers) as downloads:
+            pending: collections.deque[tuple[dict, concurrent.futures.Future]] = collections.deque()
+            for file in files:
+                pending.append((file, start(downloads, file)))
+                if len(pending) >= window:
+                    yield from finish(*pending.popleft())
+            while len(pending) > 0:
+                yield from finish(*pending.popleft())
+    finally:
+        if parsers is not None:
+            parsers.shutdown(cancel_futures=True)
+        if cache is not None:
+            cache.save()
+
+
+def test() -> None:
+    """
+    Check which Drive files are selected as new, and that parsed documents
+    are taken from the cache
+    """
+    global download_data, parse_workers
+    import tempfile
+
+    def drive_file(name: str, file_id: str, content: bytes) -> dict:
+        return { "id": file_id, "name": name, "webViewLink": f"https://drive/{file_id}",
+                 "sha256Checksum": parse_cache.content_hash(content) }
+
+    files = [ drive_file("parsed.pdf", "1", b"parsed"),
+              # Renamed after it was parsed
+              drive_file("renamed.pdf", "2", b"renamed"),
+              # Uploaded again with the content of a parsed file
+              drive_file("parsed copy.pdf", "3", b"parsed"),
+              drive_file("new.pdf", "4", b"new"),
+              drive_file("new copy.pdf", "5", b"new"),
+              { "id": "6", "name": "listed.pdf", "webViewLink": "https://drive/6" } ]
+    names = { "parsed.pdf", "old name.pdf" }
+    links = { "https://drive/1", "https://drive/2" }
+    assert [ file["id"] for file in new_files(files, names, links) ] == [ "4", "6" ]
+    assert [ file["id"] for file in new_files(files, set(), set()) ] == [ "1", "2", "4", "6" ]
+
+    # Without a checksum, the document is cached by the hash of its content
+    contents = { file["id"]: file["name"].encode() for file in files }
+    parsed: list[str] = []
+
+    def parse(stream: io.BytesIO) -> str:
+        parsed.append(stream.getvalue().decode())
+        return parsed[-1]
+
+    saved = (download_data, parse_workers)
+    download_data = lambda file_id: contents[file_id]
+    parse_workers = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for expected in [ [ "new.pdf", "listed.pdf" ], [] ]:
+                cache: parse_cache.ParseCache[str] = parse_cache.ParseCache(
+                    "test", "1", lambda document: { "text": document }, lambda data: data["text"], tmpdir)
+                parsed.clear()
+                results = list(download_and_parse([ files[3], files[5] ], parse, cache))
+                assert [ document for _, document in results ] == [ "new.pdf", "listed.pdf" ]
+                assert parsed == expected, parsed
+            assert parse_cache.content_hash(b"listed.pdf") in cache.entries
+    finally:
+        download_data, parse_workers = saved
+
+
+if __name__ == "__main__":
+    test()
@@ -1,7 +1,9 @@
 """
 Download and parse attestation files. Update output/attestations.csv
 
-Skips files previously parsed.
+Skips files previously parsed. With reparse, the records are rebuilt from
+all the files, reading documents parsed before by the same parser version
+from the parse cache, and keeping the reviewed and ignore columns of each file.
 """
 
 import time
@@ -10,6 +12,7 @@ from googleapiclient.discovery import build  # type: ignore
 import docs
 import parse_pdf
 import gdrive
+import download_pdfs
 
 def move_new_signed_docs(drive, folder_src_name, folder_dst_name) -> int:
 
@@ -39,12 +42,20 @@ def upload_attestation_csv_file(drive, local_file_name, remote_folder_name, remo
         gdrive.update_csv_file(drive, remote_file_id, local_file_name)
 
 
-def run(upload: bool = False) -> None:
+def run(upload: bool = False, reparse: bool = False) -> None:
     """
     Scrape all attestation PDF files and create a CSV file
     """
     attestations: list[docs.Attestation] = []
     attestations = docs.Attestation.read_csv()
+    # Records replaced by a reparse, to keep the columns maintained by hand
+    previous_links: dict[str, docs.Attestation] = {}
+    previous_names: dict[str, docs.Attestation] = {}
+    if reparse:
+        print(f"Note: reparse all documents, replacing {len(attestations)} records")
+        previous_links = { attestation.web_view_link: attestation for attestation in attestations }
+        previous_names = { attestation.file_name: attestation for attestation in attestations }
+        attestations = []
 
     gdrive.login()
     drive = build("drive", "v3", credentials=gdrive.creds)
@@ -63,24 +74,24 @@ def run(upload: bool = False) -> None:
         return
 
     filenames: set[str] = set(attestation.file_name for attestation in attestations)
+    links: set[str] = set(attestation.web_view_link for attestation in attestations)
 
     print("Processing Files:")
-    skipped_count = 0
     parsed_count = 0
- 
-    for file in files:
-        # Check if file has already been processed
-        if file["name"] in filenames:
-            #print(f"Note: already parsed {file['name']} - skipping")
-            skipped_count += 1
-            continue
+    # Skip files already processed, renamed or copied
+    new_files = download_pdfs.new_files(files, filenames, links)
+    skipped_count = len(files) - len(new_files)
 
+    cache = parse_pdf.open_cache("attest", parse_pdf.AttestationPDF.from_dict)
+    for file, attestation_pdf in download_pdfs.download_and_parse(new_files, parse_pdf.parse_attestation_pdf, cache):
         print(f"{file['name']}")
-        file_data = gdrive.download_file(drive, file["id"])
-        attestation_pdf = parse_pdf.parse_attestation_pdf(file_data)
         attestation_pdf.file_name = file["name"]
         attestation_pdf.web_view_link = file["webViewLink"]
         attestation = attestation_pdf.parse_attestation()
+        previous = previous_links.get(attestation.web_view_link) or previous_names.get(attestation.file_name)
+        if previous is not None:
+            attestation.reviewed = previous.reviewed
+            attestation.ignore = previous.ignore
         attestations.append(attestation)
         parsed_count += 1
 
@@ -2,7 +2,9 @@
 Download and parse guest waiver PDF files on Google drive.
 Update guest_waivers.csv
 
-Skips documents previously parsed.
+Skips documents previously parsed. With reparse, the records are rebuilt from
+all the files, reading documents parsed before by the same parser version
+from the parse cache.
 """
 
 import time
@@ -12,6 +14,7 @@ from googleapiclient.discovery import build  # type: ignore
 import parse_pdf
 import docs
 import gdrive
+import download_pdfs
 
 
 def move_new_signed_docs(drive, folder_src_name, folder_dst_name) -> int:
@@ -43,7 +46,7 @@ def upload_guest_waiver_list(drive, local_file_name):
         gdrive.update_csv_file(drive, remote_file_id, local_file_name)
 
 
-def run(upload: bool = False) -> None:
+def run(upload: bool = False, reparse: bool = False) -> None:
     """
     Scrape guest waiver PDF files and create a CSV file
     """
@@ -51,6 +54,9 @@ def run(upload: bool = False) -> None:
 
     # Load existing waivers
     waivers = docs.GuestWaiver.read_csv()
+    if reparse:
+        print(f"Note: reparse all documents, replacing {len(waivers)} records")
+        waivers = []
 
     folder_src_name = f"{docs.ROOT_DIR}/Requested signatures"
     folder_name = f"{docs.ROOT_DIR}/{docs.YEAR}/{docs.YEAR} Guest Waivers"
@@ -67,23 +73,18 @@ def run(upload: bool = False) -> None:
         print("No files found.")
         return
 
-    filenames: dict[str, bool] = {waiver.file_name: True for waiver in waivers}
+    filenames: set[str] = set(waiver.file_name for waiver in waivers)
+    links: set[str] = set(waiver.web_view_link for waiver in waivers)
 
     print("Processing Files:")
-    skipped_count = 0
     parsed_count = 0
- 
-    for file in files:
-
-        # Check if file has been parsed already.
-        if file["name"] in filenames:
-            #print(f"Note: already parsed {file['name']} - skipping")
-            skipped_count += 1
-            continue
+    # Skip files parsed already, renamed or copied
+    new_files = download_pdfs.new_files(files, filenames, links)
+    skipped_count = len(files) - len(new_files)
 
+    cache = parse_pdf.open_cache("guest", parse_pdf.GuestWaiverPDF.from_dict)
+    for file, waiver_pdf in download_pdfs.download_and_parse(new_files, parse_pdf.parse_guest_waiver_pdf, cache):
         print(f"{file['name']}")
-        file_data = gdrive.download_file(drive, file["id"])
-        waiver_pdf = parse_pdf.parse_guest_waiver_pdf(file_data)
         print(waiver_pdf)
         file_name = file["name"]
         web_view_link = file["webViewLink"]
@@ -3,7 +3,9 @@ Download and parse member waiver PDF files on Google drive.
 Update waiver docs: member_waivers.csv with information
 Call waiver_calcs update and review functions to update member waiver records
 
-Skips previously downloaded files
+Skips previously downloaded files. With reparse, the records are rebuilt from
+all the files, reading documents parsed before by the same parser version
+from the parse cache, and keeping the reviewed column of each file.
 """
 
 import time
@@ -12,6 +14,7 @@ from googleapiclient.discovery import build  # type: ignore
 import parse_pdf
 import docs
 import gdrive
+import download_pdfs
 
 
 def move_new_signed_docs(drive, folder_src_name, folder_dst_name) -> int:
@@ -44,13 +47,21 @@ def upload_member_csv_file(drive, local_file_name, remote_folder_name, remote_fi
 
 
 
-def run(upload: bool = False) -> None:
+def run(upload: bool = False, reparse: bool = False) -> None:
     """
     Scrape guest waiver PDF files and create a CSV file
     """
     # Load existing waivers
     waivers: list[docs.MemberWaiver] = []
     waivers = docs.MemberWaiver.read_csv()
+    # Records replaced by a reparse, to keep the reviewed column maintained by hand
+    previous_links: dict[str, docs.MemberWaiver] = {}
+    previous_names: dict[str, docs.MemberWaiver] = {}
+    if reparse:
+        print(f"Note: reparse all documents, replacing {len(waivers)} records")
+        previous_links = { waiver.web_view_link: waiver for waiver in waivers }
+        previous_names = { waiver.file_name: waiver for waiver in waivers }
+        waivers = []
 
     gdrive.login()
     drive = build("drive", "v3", credentials=gdrive.creds)
@@ -70,21 +81,18 @@ def run(upload: bool = False) -> None:
         print("No files found.")
         return
 
-    filenames: dict[str, bool] = {waiver.file_name: True for waiver in waivers}
+    filenames: set[str] = set(waiver.file_name for waiver in waivers)
+    links: set[str] = set(waiver.web_view_link for waiver in waivers)
 
     print("Processing Files:")
-    skipped_count = 0
     parsed_count = 0
-    for file in files:
-        # Check if file has already been parsed
-        if file["name"] in filenames:
-            #print(f"Note: already parsed {file['name']} - skipping")
-            skipped_count += 1
-            continue
+    # Skip files already parsed, renamed or copied
+    new_files = download_pdfs.new_files(files, filenames, links)
+    skipped_count = len(files) - len(new_files)
 
+    cache = parse_pdf.open_cache("member", parse_pdf.MemberWaiverPDF.from_dict)
+    for file, waiver_pdf in download_pdfs.download_and_parse(new_files, parse_pdf.parse_member_waiver_pdf, cache):
         print(f"{file['name']}")
-        file_data = gdrive.download_file(drive, file["id"])
-        waiver_pdf = parse_pdf.parse_member_waiver_pdf(file_data)
         print(waiver_pdf)
         file_name = file["name"]
         web_view_link = file["webViewLink"]
@@ -103,6 +111,9 @@ def run(upload: bool = False) -> None:
         waiver.minors = waiver_pdf.minors.copy()
         waiver.file_name = file_name
         waiver.web_view_link = web_view_link
+        previous = previous_links.get(web_view_link) or previous_names.get(file_name)
+        if previous is not None:
+            waiver.reviewed = previous.reviewed
         waivers.append(waiver)
         parsed_count += 1
 
@@ -6,6 +6,7 @@ Utility functions for accessing files on Google Drive
 import os.path
 import io
 import hashlib
+import threading
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -16,9 +17,13 @@ from googleapiclient.http import MediaIoBaseDownload  # type: ignore
 from googleapiclient.http import MediaIoBaseUpload   # type: ignore
 from googleapiclient.http import MediaFileUpload   # type: ignore
 
+import instrument
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/drive"]
 creds = None
+# Drive service of each download thread
+_thread_local = threading.local()
 
 
 def login():
@@ -43,6 +48,22 @@ def login():
         with open("token.json", "w") as token:
             token.write(creds.to_json())
 
+def thread_drive():
+    """
+    Return a Drive service for the calling thread, login() must be called first.
+    A service has its own http connection, which is not safe to share between threads.
+    """
+    if not hasattr(_thread_local, "drive"):
+        _thread_local.drive = build("drive", "v3", credentials=creds)
+    return _thread_local.drive
+
+def execute(request):
+    """
+    Execute a Drive API request, counting the calls made
+    """
+    instrument.count("gdrive.api_calls")
+    return request.execute()
+
 def get_folder_id(drive, folder_path):
     """
     Return ID of a single folder matching the path
@@ -56,7 +77,7 @@ def get_folder_id(drive, folder_path):
     print(f"Get folder id for: {folder_path}")
 
     for folder_name in folder_path.split('/'):
-        qresult = (
+        qresult = execute(
             drive.files()
             .list(
                 q="mimeType = 'application/vnd.google-apps.folder' and name = '"
@@ -66,7 +87,7 @@ def get_folder_id(drive, folder_path):
                 includeItemsFromAllDrives=True,
                 supportsAllDrives=True,
                 fields="nextPageToken, files(id, parents)",
-            ).execute()
+            )
         )
         folders = qresult.get("files", [])
         matches = []
@@ -94,7 +115,7 @@ def get_folder_id(drive, folder_path):
 
 def get_file_id(drive, folder_id, filename) -> str|None:
     query = f"name='{filename}' and '{folder_id}' in parents"
-    results = drive.files().list(q=query).execute()
+    results = execute(drive.files().list(q=query))
     files = results.get('files', [])
     print(f"Lookup remote {filename} in {folder_id}")
     if files is None or len(files) == 0:
@@ -109,38 +130,37 @@ def get_file_id(drive, folder_id, filename) -> str|None:
 
 def get_file_list(drive, folder_name):
     """
-    Return the list of files in a folder.
+    Return the list of files in a folder, with the sha256 of their content.
     """
     fid = get_folder_id(drive, folder_name)
     if fid is None:
         return []
 
-    results = (
+    results = execute(
         drive.files()
         .list(
             q="'" + fid + "' in parents and mimeType = 'application/pdf'",
             pageSize=1000,
-            fields="nextPageToken, files(id, name, webViewLink)",
+            fields="nextPageToken, files(id, name, webViewLink, sha256Checksum)",
         )
-        .execute()
     )
     items = results.get("files", [])
     return items
 
 def move_file(drive, file_id, new_folder_id):
     # Get existing parents / folders
-    file = drive.files().get(fileId=file_id, fields='parents').execute()
+    file = execute(drive.files().get(fileId=file_id, fields='parents'))
     previous_parents = file.get('parents', [])
     body = {
         'addParents': new_folder_id,
         'removeParents': ','.join(previous_parents)
     }
     # Update files parent folder
-    drive.files().update(fileId=file_id, 
-                         addParents=new_folder_id,
-                         removeParents=','.join(previous_parents),
-                         fields='id, parents'
-                         ).execute()
+    execute(drive.files().update(fileId=file_id,
+                                 addParents=new_folder_id,
+                                 removeParents=','.join(previous_parents),
+                                 fields='id, parents'
+                                 ))
     print(f"Moved {file_id} to {new_folder_id}")
 
 def update_csv_file(drive, file_id, name: str):
@@ -164,10 +184,11 @@ def update_csv_file(drive, file_id, name: str):
 
     print("Writing file...")
     media = MediaFileUpload(name, mimetype='text/csv')
-    updated_file = drive.files().update(
+    updated_file = execute(drive.files().update(
         fileId=file_id,
         media_body=media,
-        fields="id").execute()
+        fields="id"))
+    instrument.count("gdrive.files_uploaded")
     return updated_file
 
 def upload_csv_file(drive, folder_id: str, filename: str, name: str):
@@ -175,12 +196,14 @@ def upload_csv_file(drive, folder_id: str, filename: str, name: str):
     metadata = {'name': filename, 
                 'parents': [folder_id]}
     print(f"Upload file {name} to {filename} in {folder_id} - Writing file...")
-    updated_file = drive.files().create(
+    updated_file = execute(drive.files().create(
         body=metadata,
         media_body=media,
-        fields="id").execute()
+        fields="id"))
+    instrument.count("gdrive.files_uploaded")
     return updated_file
 
+@instrument.timed("gdrive.download_file")
 def download_file(drive, file_id) -> io.BytesIO:
     """
     Get a GDrive file by ID and return a bytes stream
@@ -191,5 +214,8 @@ def download_file(drive, file_id) -> io.BytesIO:
     downloader = MediaIoBaseDownload(file, request)
     done = False
     while done is False:
+        instrument.count("gdrive.api_calls")
         status, done = downloader.next_chunk()
+    instrument.count("gdrive.files_downloaded")
+    instrument.count("gdrive.bytes_downloaded", file.getbuffer().nbytes)
     return file
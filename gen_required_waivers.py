@@ -22,27 +22,17 @@ def select_possible_parents(
     """
     Identify adults that may be parents of minor children.
     """
-    if not membership.has_minor_children(account.account_num):
+    household = membership.get_household(account.account_num)
+    if not household.has_minors():
         return []
 
-    members = membership.get_members_for_account_num(account.account_num)
-
-    # get minor min age
-    # get minor max age
-    num_minors = 0
-    min_minor = 18
-    max_minor = 0
-    for member in members:
-        if member.is_minor():
-            # Assumed minor child
-            num_minors += 1
-            if member.has_birthdate():
-                min_minor = min(min_minor, member.age())
-                max_minor = max(max_minor, member.age())
+    # Without minors with birthdates, any adult age fits
+    min_minor = household.min_minor_age if household.min_minor_age is not None else 18
+    max_minor = household.max_minor_age if household.max_minor_age is not None else 0
 
     # find adults in age range relative to minor children
     possible_parents = []
-    for member in members:
+    for member in household.members:
         if not member.is_adult_type():
             continue
 
@@ -82,92 +72,138 @@ def select_parents(
     return possible_parents
 
 
+def eligible_accounts(membership: memberdata.Membership) -> list[memberdata.AccountEntry]:
+    """
+    Accounts that need waivers, in the order the groupings are generated
+    """
+    return [ account for account in membership.active_member_accounts()
+             if account.is_proprietary_member() or account.is_alumni_pass() ]
+
+
 def generate(membership: memberdata.Membership, member_keys: keys.MemberKeys) -> RequiredWaivers:
     """
     Generate groups of waiver requests
     """
     groups = RequiredWaivers()
+    membership.set_key_holders(member_keys.key_holders())
 
     # Iterate through accounts
-    for account in membership.active_member_accounts():
-        # Only include active member accounts
-        if not account.is_proprietary_member() and not account.is_alumni_pass():
-            continue
+    for account in eligible_accounts(membership):
+        generate_account(membership, account, groups)
 
-        # Load defined parents
-        parent_recs = membership.get_families_for_account(account.account_num)
-        if len(parent_recs) == 0:
-            # If not defined, select who might be parents
-            possible_parents = select_possible_parents(membership, account)
-        else:
-            # If defined, include all parents in list of possible parents to include in family records, not adult records
-            possible_parents = []
-            for parent_rec in parent_recs:
-                for parent in parent_rec.parents:
-                    possible_parents.append(parent)
-
-        members = membership.get_members_for_account_num(account.account_num)
-
-        # Collect adults without minor aged children
-        for member in members:
-            if member.is_minor() or member in possible_parents:
-                continue
-            record = RequiredWaiver(member)
-            if member_keys.has_key(member.member_id):
-                record.has_key = True
-                record.key_enabled = member_keys.has_enabled_key(member.member_id)
-            groups.no_minor_children.append(record)
-
-        # If this account has no minor aged children, we are done with it
-        if not membership.has_minor_children(account.account_num):
-            groups.no_minors_count += 1
-            continue
+    return groups
 
-        # Process parent recs if parents defined
-        if len(parent_recs) > 0:
-            # Use defined rec instead of guessing
-            num_minors = 0
-            for parent_rec in parent_recs:
-                family = RequiredWaiver()
-                for parent in parent_rec.parents:
-                    family.adults.append(parent)
-                for minor in parent_rec.minors:
-                    num_minors += 1
-                    family.minors.append(minor)
-                groups.with_minor_children.append(family)
-            if num_minors != membership.number_minor_children(account.account_num):
-                print(f"Error: missing minor entries in account {account.account_num}")
-            continue
 
-        # Build list of parents and minor children
-        # Collect adults with minor aged children
-        parents = select_parents(membership, account)
-        if len(parents) == 0:
-            known_parents = False
-            parents = possible_parents
+def update(membership: memberdata.Membership, member_keys: keys.MemberKeys,
+           groups: RequiredWaivers, account_nums: set[str]) -> None:
+    """
+    Regenerate the groups of waiver requests for the given accounts and merge
+    them into groups. Records of other accounts are kept as they are.
+    """
+    membership.set_key_holders(member_keys.key_holders())
+    accounts = eligible_accounts(membership)
+    # Accounts no longer eligible are left with no records
+    updates = { account_num: RequiredWaivers() for account_num in account_nums }
+    for account in accounts:
+        if account.account_num in account_nums:
+            generate_account(membership, account, updates[account.account_num])
+
+    account_order = [ account.account_num for account in accounts ]
+    groups.merge(updates, account_order)
+    count_accounts(membership, groups)
+
+
+def count_accounts(membership: memberdata.Membership, groups: RequiredWaivers) -> None:
+    """
+    Set the account statistics of groups from the households and grouped records.
+    """
+    unknown_accounts = { record.group_account_num for record in groups.unknown_status }
+    groups.no_minors_count = 0
+    groups.unknown_parents_count = 0
+    groups.known_parents_count = 0
+    for account in eligible_accounts(membership):
+        if not membership.get_household(account.account_num).has_minors():
+            groups.no_minors_count += 1
+        elif len(membership.get_families_for_account(account.account_num)) > 0:
+            continue
+        elif account.account_num in unknown_accounts:
             groups.unknown_parents_count += 1
         else:
-            known_parents = True
             groups.known_parents_count += 1
 
-        family = RequiredWaiver()
-        for member in parents:
-            family.adults.append(member)
-            family.key_enabled = family.key_enabled or member_keys.has_enabled_key(member.member_id)
-            if member_keys.has_key(member.member_id):
-                family.has_key = True
-
-        for member in members:
-            if member.is_minor():
-                family.minors.append(member)
-            family.key_enabled = family.key_enabled or member_keys.has_enabled_key(member.member_id)
-            if member_keys.has_key(member.member_id):
-                family.has_key = True
-
-        if known_parents:
-            groups.with_minor_children.append(family)
-        else:
-            groups.unknown_status.append(family)
 
+def generate_account(membership: memberdata.Membership, account: memberdata.AccountEntry,
+                     groups: RequiredWaivers) -> None:
+    """
+    Add the waiver requests for one account to groups.
+    Key holders are taken from the household, see Membership.set_key_holders().
+    """
+    household = membership.get_household(account.account_num)
+
+    # Load defined parents
+    parent_recs = membership.get_families_for_account(account.account_num)
+    if len(parent_recs) == 0:
+        # If not defined, select who might be parents
+        possible_parents = select_possible_parents(membership, account)
+    else:
+        # If defined, include all parents in list of possible parents to include in family records, not adult records
+        possible_parents = []
+        for parent_rec in parent_recs:
+            for parent in parent_rec.parents:
+                possible_parents.append(parent)
 
-    return groups
+    # Collect adults without minor aged children
+    for member in household.adults:
+        if member in possible_parents:
+            continue
+        record = RequiredWaiver(member)
+        if member.member_id in household.key_holders:
+            record.has_key = True
+            record.key_enabled = household.key_holders[member.member_id]
+        groups.add_adult_record(record)
+
+    # If this account has no minor aged children, we are done with it
+    if not household.has_minors():
+        groups.no_minors_count += 1
+        return
+
+    # Process parent recs if parents defined
+    if len(parent_recs) > 0:
+        # Use defined rec instead of guessing
+        num_minors = 0
+        for parent_rec in parent_recs:
+            family = RequiredWaiver()
+            family.group_account_num = account.account_num
+            for parent in parent_rec.parents:
+                family.adults.append(parent)
+            for minor in parent_rec.minors:
+                num_minors += 1
+                family.minors.append(minor)
+            groups.add_family_record(family)
+        if num_minors != len(household.minors):
+            print(f"Error: missing minor entries in account {account.account_num}")
+        return
+
+    # Build list of parents and minor children
+    # Collect adults with minor aged children
+    parents = select_parents(membership, account)
+    if len(parents) == 0:
+        known_parents = False
+        parents = possible_parents
+        groups.unknown_parents_count += 1
+    else:
+        known_parents = True
+        groups.known_parents_count += 1
+
+    family = RequiredWaiver()
+    family.group_account_num = account.account_num
+    family.adults.extend(parents)
+    family.minors.extend(household.minors)
+    # Parents are members of the account, so the household covers their keys
+    family.has_key = household.has_keys()
+    family.key_enabled = household.has_enabled_keys()
+
+    if known_parents:
+        groups.add_family_record(family)
+    else:
+        groups.add_unknown_record(family)
@@ -6,6 +6,7 @@ import sys
 from dataclasses import dataclass, field
 import csv
 import memberdata
+import profiling
 
 @dataclass
 class Vote:
@@ -31,15 +32,14 @@ def generate_vote_list(membership: memberdata.Membership ) -> list[Vote]:
 
         primary_member = None
         other_members = []
-        members = membership.get_members_for_account_num(account.account_num)
-        for member in members:
+        for member in membership.get_household(account.account_num).members:
             if not member.is_adult_type():
                 continue
             if member.name == account.billing_name:
                 primary_member = member
                 continue
             other_members.append(member)
-        
+
         if primary_member is None:
             print(f"Error finding primary {account.billing_name}")
             continue
@@ -93,8 +93,10 @@ def main():
     membership.read_csv_files()
     votes = generate_vote_list(membership)
     write_csv(votes)
+    profiling.checkpoint("end of gen_vote_rolls")
     
 
 if __name__ == "__main__":
+    profile = profiling.requested()
     print("Running gen_vote_rolls")
-    main()
+    profiling.run("gen_vote_rolls", main, profile)
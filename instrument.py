@@ -0,0 +1,142 @@
+"""
+Lightweight instrumentation of a run: spans, timers, counters and gauges.
+
+  - span: times a stage of the run, spans nest
+  - timed: adds up the calls and time of a function
+  - count: adds up events, such as names resolved or Drive API calls
+  - gauge: records the last value of a quantity, such as members loaded
+
+write_trace saves everything collected by the run to a JSON file with sorted
+keys, so the traces of two runs can be diffed.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import datetime
+import threading
+import functools
+import contextlib
+from typing import Callable, Iterator, ParamSpec, TypeVar
+
+import profiling
+
+
+TRACE_DIR = "output"
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+# Reports may be generated by a pool of threads
+_lock = threading.Lock()
+# Names of the open spans of each thread
+_local = threading.local()
+
+run_start = time.perf_counter()
+run_started = datetime.datetime.now()
+spans: list[dict] = []
+timers: dict[str, dict[str, float]] = {}
+counters: dict[str, int] = {}
+gauges: dict[str, float] = {}
+
+
+def reset() -> None:
+    """
+    Discard everything recorded and start a new run
+    """
+    global run_start, run_started
+    with _lock:
+        run_start = time.perf_counter()
+        run_started = datetime.datetime.now()
+        spans.clear()
+        timers.clear()
+        counters.clear()
+        gauges.clear()
+
+
+def _open_spans() -> list[str]:
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    return _local.spans
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time a stage of the run. Nested spans are named by their path: "waivers/load"
+    """
+    open_spans = _open_spans()
+    open_spans.append(name)
+    path = "/".join(open_spans)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        open_spans.pop()
+        with _lock:
+            spans.append({ "name": path,
+                           "start": round(start - run_start, 6),
+                           "seconds": round(seconds, 6) })
+        profiling.checkpoint(f"end of {path}")
+
+
+def add_time(name: str, seconds: float) -> None:
+    with _lock:
+        timer = timers.setdefault(name, { "calls": 0, "seconds": 0.0 })
+        timer["calls"] += 1
+        timer["seconds"] += seconds
+
+
+def timed(name: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """
+    Decorator adding the calls of a function to a timer
+    """
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name: str, amount: int = 1) -> None:
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def gauge(name: str, value: float) -> None:
+    with _lock:
+        gauges[name] = value
+
+
+def trace(run_name: str) -> dict:
+    with _lock:
+        return { "run": run_name,
+                 "started": run_started.isoformat(timespec="seconds"),
+                 "seconds": round(time.perf_counter() - run_start, 6),
+                 "spans": sorted(spans, key=lambda entry: entry["start"]),
+                 "timers": { name: { "calls": timer["calls"], "seconds": round(timer["seconds"], 6) }
+                             for name, timer in timers.items() },
+                 "counters": dict(counters),
+                 "gauges": dict(gauges) }
+
+
+def write_trace(run_name: str, trace_dir: str = TRACE_DIR) -> str | None:
+    """
+    Write the trace of the run to <trace_dir>/trace_<run_name>_<date>_<time>.json
+    Return the file name, None if the directory does not exist.
+    """
+    if not os.path.isdir(trace_dir):
+        return None
+    filename = os.path.join(trace_dir, f"trace_{run_name}_{run_started.strftime('%Y%m%d_%H%M%S')}.json")
+    print(f"Note: write trace {filename}")
+    with open(filename, "w") as f:
+        json.dump(trace(run_name), f, indent=1, sort_keys=True)
+    return filename
@@ -47,6 +47,10 @@ class MemberKeys:
     def has_enabled_key(self, member_id: str) -> bool:
         return self.has_key(member_id) and self.member_key_map[member_id].enabled
 
+    def key_holders(self) -> dict[str, bool]:
+        """Members holding keys: member_id -> key enabled"""
+        return { member_id: key_entry.enabled for member_id, key_entry in self.member_key_map.items() }
+
     def member_email(self, member_id: str) -> str:
         key_entry = self.member_key_map.get(member_id)
         if key_entry is not None:
@@ -135,19 +139,21 @@ def gen_member_key_map(membership: memberdata.Membership,
     Used to find key information for a specific member
     """
     member_key_map = {}
+    matches = membership.resolve_names((key_entry.member_name for key_entry in key_entries
+                                        if not key_entry.is_staff()), warn=False)
 
     for key_entry in key_entries:
         if key_entry.is_staff():
             continue
 
-        members = membership.find_members_by_name(key_entry.member_name)
-        if len(members) == 0:
+        match = matches[key_entry.member_name]
+        member = match.member
+        if member is None:
             print(f"Warning: no members found for key file name {key_entry.member_name}")
             continue
-        elif len(members) > 1:
+        elif match.ambiguous:
             print(f"Warning: muiltiple members found for key file name {key_entry.member_name}")
 
-        member = members[0]
         key_entry.member_id = member.member_id
         if member.account_num != key_entry.account_num:
             print(
@@ -2,14 +2,22 @@
 Access Membership accounts and members via exported CSV files
 """
 
+from __future__ import annotations
+
+import bisect
 import csv
+import json
 import os
+import pickle
 import datetime
+import enum
 import sys
 import re
-from dataclasses import dataclass, field
-from collections.abc import Iterator
+from dataclasses import InitVar, dataclass, field
+from collections.abc import Iterable, Iterator
+from typing import TypeVar
 import csvfile
+import instrument
 
 # Default filenames for CSVs
 MEMBERS_CSV = "input/members.csv"
@@ -20,9 +28,14 @@ ACCOUNTS_TEST_CSV = "test/accounts.test.csv"
 PARENTS_CSV = "data/families.csv"
 PARENTS_TEST_CSV = "test/families.csv"
 DUES_CSV = "input/dues_tracking.csv"
+NAME_CACHE_FILE = "data/name_cache.json"
+SNAPSHOT_FILE = "data/membership.pickle"
 
+# Increment when the layout of Membership or the entry classes change
+SNAPSHOT_VERSION = 7
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class MemberName:
     """First and last name"""
 
@@ -74,45 +87,81 @@ class MemberName:
 
 
 
-@dataclass
+class MemberType(enum.IntEnum):
+    """Member Type column values, stored as small codes"""
+
+    OTHER = 0
+    ADULT = 1
+    CHILD = 2
+    CARETAKER = 3
+
+    @staticmethod
+    def from_label(label: str) -> MemberType:
+        return MEMBER_TYPE_LABELS.get(label, MemberType.OTHER)
+
+
+MEMBER_TYPE_LABELS = {
+    "Adult": MemberType.ADULT,
+    "Child": MemberType.CHILD,
+    "Family Caretaker": MemberType.CARETAKER,
+}
+
+
+@dataclass(slots=True)
 class MemberEntry:
     """Represents the data for a specific club member"""
 
     name: MemberName
     account_num: str
     member_id: str
-    member_type: str
+    member_type: MemberType
     email: str
     birthdate: datetime.date
+    # Date the age is computed for, default today
+    as_of: InitVar[datetime.date | None] = None
+
+    # Derived from the birthdate as of a date, see set_as_of_date()
+    _age: int = field(default=0, init=False, repr=False, compare=False)
+    _has_birthdate: bool = field(default=False, init=False, repr=False, compare=False)
+    _minor: bool = field(default=False, init=False, repr=False, compare=False)
+
+    def __post_init__(self, as_of: datetime.date | None) -> None:
+        self.set_as_of_date(as_of or datetime.date.today())
 
     def __hash__(self):
         return hash((self.name, self.account_num, self.member_id, self.member_type, self.email, self.birthdate))
 
+    def set_as_of_date(self, as_of: datetime.date) -> None:
+        """
+        Compute the age and minor status of the member as of a date.
+        """
+        years = as_of.year - self.birthdate.year
+        if (self.birthdate.month, self.birthdate.day) > (as_of.month, as_of.day):
+            years -= 1
+        has_birthdate = years >= 0 and years < 110
+        minor = (has_birthdate and years < 18) or (not has_birthdate and self.is_child_type())
+
+        self._age = years
+        self._has_birthdate = has_birthdate
+        self._minor = minor
+
     def has_birthdate(self) -> bool:
-        age = self.age()
-        return age >= 0 and age < 110
+        return self._has_birthdate
 
     def is_child_type(self) -> bool:
-        return self.member_type == "Child"
+        return self.member_type == MemberType.CHILD
 
     def is_adult_type(self) -> bool:
-        return self.member_type == "Adult"
+        return self.member_type == MemberType.ADULT
 
     def is_caretaker_type(self) -> bool:
-        return self.member_type == "Family Caretaker"
+        return self.member_type == MemberType.CARETAKER
 
     def age(self) -> int:
-        today = datetime.date.today()
-        years = today.year - self.birthdate.year
-        birthday = self.birthdate.replace(year=today.year)
-        if birthday > today:
-            years -= 1
-        return years
+        return self._age
 
-    def is_minor(self):
-        return (self.has_birthdate() and self.age() < 18) or (
-            not self.has_birthdate() and self.is_child_type()
-        )
+    def is_minor(self) -> bool:
+        return self._minor
 
     """Column names for member entries"""
     FIELD_ACCOUNT_NUM = "Acct #"
@@ -169,6 +218,190 @@ class ParentRec:
     minors: list[MemberEntry] = field(default_factory=list)
 
 
+@dataclass
+class Household:
+    """Members of an account grouped by role, built once after loading"""
+
+    account_num: str
+    members: list[MemberEntry] = field(default_factory=list)
+    minors: list[MemberEntry] = field(default_factory=list)
+    adults: list[MemberEntry] = field(default_factory=list)  # members that are not minors
+    caretakers: list[MemberEntry] = field(default_factory=list)
+    primary: MemberEntry | None = None
+    # Youngest and oldest minor with a birthdate
+    min_minor_age: int | None = None
+    max_minor_age: int | None = None
+    # Members holding keys: member_id -> key enabled, see Membership.set_key_holders()
+    key_holders: dict[str, bool] = field(default_factory=dict)
+
+    def has_minors(self) -> bool:
+        return len(self.minors) > 0
+
+    def has_keys(self) -> bool:
+        return len(self.key_holders) > 0
+
+    def has_enabled_keys(self) -> bool:
+        return any(self.key_holders.values())
+
+    def num_enabled_keys(self) -> int:
+        return sum(1 for enabled in self.key_holders.values() if enabled)
+
+
+@dataclass
+class RosterChanges:
+    """
+    Differences found when reloading the account and member files.
+    Changed members are recorded as (old entry, new entry).
+    """
+
+    added: list[MemberEntry] = field(default_factory=list)
+    removed: list[MemberEntry] = field(default_factory=list)
+    moved_account: list[tuple[MemberEntry, MemberEntry]] = field(default_factory=list)
+    birthdate_changed: list[tuple[MemberEntry, MemberEntry]] = field(default_factory=list)
+    email_changed: list[tuple[MemberEntry, MemberEntry]] = field(default_factory=list)
+    # Name or member type changed
+    other_changed: list[tuple[MemberEntry, MemberEntry]] = field(default_factory=list)
+    accounts_added: list[str] = field(default_factory=list)
+    accounts_removed: list[str] = field(default_factory=list)
+    # Account type, billing name or email changed
+    accounts_changed: list[str] = field(default_factory=list)
+    # Same members listed in a different order, which may change the first match
+    accounts_reordered: list[str] = field(default_factory=list)
+
+    def changed_members(self) -> list[tuple[MemberEntry, MemberEntry]]:
+        """
+        All changed members, each listed once
+        """
+        result: list[tuple[MemberEntry, MemberEntry]] = []
+        seen: set[int] = set()
+        for change in (self.moved_account + self.birthdate_changed
+                       + self.email_changed + self.other_changed):
+            if id(change[0]) not in seen:
+                seen.add(id(change[0]))
+                result.append(change)
+        return result
+
+    def affected_accounts(self) -> set[str]:
+        """
+        Accounts whose members or account details changed
+        """
+        result = set(self.accounts_added + self.accounts_removed + self.accounts_changed
+                     + self.accounts_reordered)
+        for member in self.added + self.removed:
+            result.add(member.account_num)
+        for old, new in self.changed_members():
+            result.add(old.account_num)
+            result.add(new.account_num)
+        return result
+
+    def is_empty(self) -> bool:
+        return len(self.affected_accounts()) == 0
+
+    def __str__(self) -> str:
+        return (f"{len(self.added)} added, {len(self.removed)} removed, "
+                f"{len(self.moved_account)} moved account, "
+                f"{len(self.birthdate_changed)} birthdate changed, "
+                f"{len(self.email_changed)} email changed, "
+                f"{len(self.other_changed)} other changes, "
+                f"{len(self.accounts_added)} accounts added, "
+                f"{len(self.accounts_removed)} accounts removed, "
+                f"{len(self.accounts_changed)} accounts changed, "
+                f"{len(self.accounts_reordered)} accounts reordered")
+
+
+# Name resolved by Membership.resolve_names: a fullname or a MemberName
+N = TypeVar("N", str, MemberName)
+
+
+@dataclass
+class NameMatch:
+    """Result of resolving a name string to a member"""
+
+    name: str
+    member_name: MemberName | None = None  # None if the name could not be parsed
+    member: MemberEntry | None = None
+    ambiguous: bool = False  # True if more than one member matched
+
+    def is_parsed(self) -> bool:
+        return self.member_name is not None
+
+
+class NameIndex:
+    """
+    Sorted index of member names used to answer prefix searches.
+    Names are referred to by their position in the list the index was built
+    from, so matches can be returned in that order.
+    """
+
+    def __init__(self, names: list[MemberName]) -> None:
+        self.names = names
+
+        # First names in sorted order with the position of each name
+        first_names = sorted((name.first_name, pos) for pos, name in enumerate(names))
+        self.first_keys: list[str] = [entry[0] for entry in first_names]
+        self.first_positions: list[int] = [entry[1] for entry in first_names]
+
+        # Last names in sorted order with the position of each name
+        last_names = sorted((name.last_name, pos) for pos, name in enumerate(names))
+        self.last_keys: list[str] = [entry[0] for entry in last_names]
+        self.last_positions: list[int] = [entry[1] for entry in last_names]
+
+        # Positions of names by exact first name
+        self.first_name_map: dict[str, list[int]] = {}
+        for pos, name in enumerate(names):
+            if name.first_name not in self.first_name_map:
+                self.first_name_map[name.first_name] = []
+            self.first_name_map[name.first_name].append(pos)
+
+    @staticmethod
+    def _prefix_range(keys: list[str], prefix: str) -> tuple[int, int]:
+        """
+        Return the range of sorted keys that start with prefix.
+        """
+        start = bisect.bisect_left(keys, prefix)
+        # Smallest string greater than every string with the prefix
+        upper = prefix
+        while len(upper) > 0 and ord(upper[-1]) == sys.maxunicode:
+            upper = upper[:-1]
+        if len(upper) == 0:
+            return (start, len(keys))
+        upper = upper[:-1] + chr(ord(upper[-1]) + 1)
+        return (start, bisect.bisect_left(keys, upper, lo=start))
+
+    def extending(self, member_name: MemberName) -> list[int]:
+        """
+        Positions of names whose first and last names start with those of member_name
+        """
+        first_start, first_end = NameIndex._prefix_range(self.first_keys, member_name.first_name)
+        last_start, last_end = NameIndex._prefix_range(self.last_keys, member_name.last_name)
+
+        # Scan the smaller range and check the other half of the name
+        result: list[int] = []
+        if first_end - first_start <= last_end - last_start:
+            for pos in self.first_positions[first_start:first_end]:
+                if self.names[pos].last_name.startswith(member_name.last_name):
+                    result.append(pos)
+        else:
+            for pos in self.last_positions[last_start:last_end]:
+                if self.names[pos].first_name.startswith(member_name.first_name):
+                    result.append(pos)
+        result.sort()
+        return result
+
+    def within(self, member_name: MemberName) -> list[int]:
+        """
+        Positions of names whose first and last names are prefixes of those in member_name
+        """
+        result: list[int] = []
+        first_name = member_name.first_name
+        for length in range(len(first_name) + 1):
+            for pos in self.first_name_map.get(first_name[:length], []):
+                if member_name.last_name.startswith(self.names[pos].last_name):
+                    result.append(pos)
+        result.sort()
+        return result
+
+
 class Membership:
     """Account and member entries"""
 
@@ -176,23 +409,318 @@ class Membership:
         self.member_map: dict[MemberName, list[MemberEntry]] = {}
         self.member_name_map: dict[str, list[MemberEntry]] = {}
         self.account_map: dict[str, AccountEntry] = {}
+        self.account_members_map: dict[str, list[MemberEntry]] = {}  # members for account_num
+        self.member_id_map: dict[str, MemberEntry] = {}  # MemberEntry for member_id
+        self.primary_member_map: dict[str, MemberEntry] = {}  # billing name member for account_num
+        self.ambiguous_primary_accounts: list[str] = []  # accounts with several billing name members
+        self.name_index = NameIndex([])  # prefix searches on member_map names
+        # Memoized name lookups, cleared when members are reloaded
+        self.find_cache: dict[MemberName, list[MemberEntry]] = {}
+        self.name_match_cache: dict[str | MemberName, NameMatch] = {}
+        # Name resolutions saved by a previous run: name -> (member_id, ambiguous)
+        self.saved_name_matches: dict[str | MemberName, tuple[str, bool]] = {}
+        # Digest of the account and member files, identifies the roster
+        self.roster_hash: str = ""
+        # Date used to calculate member ages
+        self.as_of_date: datetime.date = datetime.date.today()
+        # Households for account_num
+        self.households: dict[str, Household] = {}
+        # Members holding keys: member_id -> key enabled, not part of the roster
+        self.key_holders: dict[str, bool] = {}
         self.parent_map: dict[str, list[ParentRec]] = {}  # ParentRecs for account_num
 
+    @instrument.timed("memberdata.read_csv_files")
     def read_csv_files(
         self,
         accounts_file=ACCOUNTS_CSV,
         members_file=MEMBERS_CSV,
         parents_file=PARENTS_CSV,
         dues_file=DUES_CSV,
+        snapshot_file: str | None = SNAPSHOT_FILE,
+        as_of_date: datetime.date | None = None,
     ):
         """
         Read account and member CSV files.
+        If a snapshot of a previous load of the same files exists, use that instead.
+        Member ages are calculated as of as_of_date, default today.
         """
         print("Loading memberdata")
+        self.saved_name_matches = {}
+        if as_of_date is None:
+            as_of_date = datetime.date.today()
+        input_files = [accounts_file, members_file, parents_file, dues_file]
+        if snapshot_file is not None and self._load_snapshot(snapshot_file, input_files):
+            self.set_as_of_date(as_of_date)
+            self._record_loaded()
+            return
+
+        self.as_of_date = as_of_date
+        self.roster_hash = csvfile.hash_files([accounts_file, members_file])
         self._read_accounts_csv(accounts_file)
         self._read_members_csv(members_file)
         self._read_parents_csv(parents_file)
         self._read_dues_csv(dues_file)
+        self._record_loaded()
+
+        if snapshot_file is not None:
+            self._save_snapshot(snapshot_file, input_files)
+
+    @instrument.timed("memberdata.update_csv_files")
+    def update_csv_files(
+        self,
+        accounts_file=ACCOUNTS_CSV,
+        members_file=MEMBERS_CSV,
+        parents_file=PARENTS_CSV,
+        dues_file=DUES_CSV,
+        snapshot_file: str = SNAPSHOT_FILE,
+        as_of_date: datetime.date | None = None,
+    ) -> RosterChanges | None:
+        """
+        Load the CSV files starting from the previous snapshot and return the
+        changes since that snapshot.
+        Return None if there was no previous snapshot and all data was read.
+        """
+        input_files = [accounts_file, members_file, parents_file, dues_file]
+        if self._load_snapshot(snapshot_file, input_files):
+            self.saved_name_matches = {}
+            self.set_as_of_date(as_of_date or datetime.date.today())
+            self._record_loaded()
+            return RosterChanges()
+        if not self._load_snapshot(snapshot_file, input_files, current=False):
+            self.read_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                snapshot_file, as_of_date)
+            return None
+
+        if as_of_date is None:
+            as_of_date = datetime.date.today()
+        if as_of_date != self.as_of_date:
+            self.set_as_of_date(as_of_date)
+        return self.reload_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                     snapshot_file)
+
+    @instrument.timed("memberdata.reload_csv_files")
+    def reload_csv_files(
+        self,
+        accounts_file=ACCOUNTS_CSV,
+        members_file=MEMBERS_CSV,
+        parents_file=PARENTS_CSV,
+        dues_file=DUES_CSV,
+        snapshot_file: str | None = SNAPSHOT_FILE,
+    ) -> RosterChanges:
+        """
+        Read new versions of the account and member files and apply only the
+        differences to the loaded data. Entries for members that did not change
+        are kept, so references to them remain valid.
+        Accounts are matched by Acct # and members by Member ID.
+        """
+        print("Reloading memberdata")
+        input_files = [accounts_file, members_file, parents_file, dues_file]
+        account_map = self._parse_accounts_csv(accounts_file)
+        members = self._parse_members_csv(members_file, account_map)
+        changes, members = self._diff_roster(account_map, members)
+
+        self.roster_hash = csvfile.hash_files([accounts_file, members_file])
+        self.saved_name_matches = {}
+        # Maps depend on the file order, rebuild them even if no member changed
+        self._apply_roster_changes(account_map, members, changes)
+        self._clear_caches()
+        print(f"Note: roster changes: {changes}")
+
+        # Parent and dues files are small and refer to member entries, read them again
+        self._read_parents_csv(parents_file)
+        self._read_dues_csv(dues_file)
+        self._record_loaded()
+        instrument.count("memberdata.members_added", len(changes.added))
+        instrument.count("memberdata.members_removed", len(changes.removed))
+        instrument.count("memberdata.members_changed", len(changes.changed_members()))
+
+        if snapshot_file is not None:
+            self._save_snapshot(snapshot_file, input_files)
+        return changes
+
+    def _record_loaded(self) -> None:
+        instrument.gauge("memberdata.accounts_loaded", len(self.account_map))
+        instrument.gauge("memberdata.members_loaded", len(self.member_id_map))
+
+    def _diff_roster(
+        self, account_map: dict[str, AccountEntry], members: list[MemberEntry]
+    ) -> tuple[RosterChanges, list[MemberEntry]]:
+        """
+        Compare newly read accounts and members with the loaded ones.
+        Return the changes and the new members, with the loaded entry in place of
+        each unchanged member.
+        """
+        changes = RosterChanges()
+        for account_num, account in account_map.items():
+            current = self.account_map.get(account_num)
+            if current is None:
+                changes.accounts_added.append(account_num)
+            elif (current.account_type != account.account_type
+                  or current.billing_name != account.billing_name
+                  or current.email != account.email):
+                changes.accounts_changed.append(account_num)
+        for account_num in self.account_map:
+            if account_num not in account_map:
+                changes.accounts_removed.append(account_num)
+
+        old_members: dict[str, list[MemberEntry]] = {}
+        for member in self.all_members():
+            old_members.setdefault(member.member_id, []).append(member)
+        new_members: dict[str, list[MemberEntry]] = {}
+        for member in members:
+            new_members.setdefault(member.member_id, []).append(member)
+
+        kept: dict[int, MemberEntry] = {}
+        for member_id, new_entries in new_members.items():
+            old_entries = old_members.get(member_id, [])
+            if old_entries == new_entries:
+                for old, new in zip(old_entries, new_entries):
+                    kept[id(new)] = old
+                continue
+            if len(old_entries) != 1 or len(new_entries) != 1:
+                # Duplicate ids, replace all the entries
+                changes.removed.extend(old_entries)
+                changes.added.extend(new_entries)
+                continue
+            old = old_entries[0]
+            new = new_entries[0]
+            if old.account_num != new.account_num:
+                changes.moved_account.append((old, new))
+            if old.birthdate != new.birthdate:
+                changes.birthdate_changed.append((old, new))
+            if old.email != new.email:
+                changes.email_changed.append((old, new))
+            if old.name != new.name or old.member_type != new.member_type:
+                changes.other_changed.append((old, new))
+
+        for member_id, old_entries in old_members.items():
+            if member_id not in new_members:
+                changes.removed.extend(old_entries)
+        return changes, [ kept.get(id(member), member) for member in members ]
+
+    def _apply_roster_changes(
+        self, account_map: dict[str, AccountEntry], members: list[MemberEntry], changes: RosterChanges
+    ) -> None:
+        """
+        Update the maps for the new members and recompute the primary member and
+        household of the accounts in the change set.
+        The maps are rebuilt in file order so lookups match a full load.
+        """
+        self.account_map = { account_num: self.account_map.get(account_num, account)
+                             if account_num not in changes.accounts_changed else account
+                             for account_num, account in account_map.items() }
+
+        old_names = list(self.member_map.keys())
+        old_account_members = self.account_members_map
+        self.member_map = {}
+        self.member_name_map = {}
+        for member in members:
+            self._add_member_name(member)
+        self._index_accounts()
+
+        # Sorted name arrays are rebuilt only if the names changed
+        if list(self.member_map.keys()) != old_names:
+            self.name_index = NameIndex(list(self.member_map.keys()))
+
+        # Accounts with unchanged members may still list them in a different order
+        affected = changes.affected_accounts()
+        for account_num in old_account_members.keys() | self.account_members_map.keys():
+            if account_num in affected:
+                continue
+            old_entries = old_account_members.get(account_num, [])
+            new_entries = self.account_members_map.get(account_num, [])
+            if any(old is not new for old, new in zip(old_entries, new_entries)):
+                changes.accounts_reordered.append(account_num)
+
+        for account_num in changes.affected_accounts():
+            self._index_primary_member(account_num)
+            self._build_household(account_num)
+
+    # Attributes not saved in a snapshot
+    SNAPSHOT_SKIP = [ "find_cache", "name_match_cache", "saved_name_matches", "key_holders" ]
+
+    @staticmethod
+    def _file_stamps(filenames: list[str]) -> list[tuple[str, int, int]]:
+        """
+        Return (name, size, mtime) for each file, size -1 for missing files
+        """
+        stamps = []
+        for filename in filenames:
+            if os.path.exists(filename):
+                stat = os.stat(filename)
+                stamps.append((filename, stat.st_size, stat.st_mtime_ns))
+            else:
+                stamps.append((filename, -1, 0))
+        return stamps
+
+    def _load_snapshot(self, snapshot_file: str, input_files: list[str], current: bool = True) -> bool:
+        """
+        Restore the loaded data from a snapshot of the same input files.
+        If current is False, restore the snapshot even if the input files changed.
+        Return False if there is no usable snapshot.
+        """
+        if not os.path.exists(snapshot_file):
+            return False
+
+        try:
+            with open(snapshot_file, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f"Warning: unable to read snapshot '{snapshot_file}': {e}")
+            return False
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            print(f"Note: snapshot '{snapshot_file}' is from a different version")
+            return False
+
+        # Quick check on size and mtime, fall back to the file contents
+        stamps = Membership._file_stamps(input_files)
+        if current and stamps != snapshot["stamps"]:
+            sizes = [stamp[1] for stamp in stamps]
+            if sizes != [stamp[1] for stamp in snapshot["stamps"]]:
+                return False
+            if csvfile.hash_files(input_files) != snapshot["hash"]:
+                return False
+            # Same contents, record the new mtimes
+            snapshot["stamps"] = stamps
+            Membership._write_snapshot(snapshot_file, snapshot)
+
+        self.__dict__.update(snapshot["state"])
+        self._clear_caches()
+        for household in self.households.values():
+            self._set_household_keys(household)
+        print(f"Note: loaded snapshot '{snapshot_file}'")
+        print(f"Note: Loaded {len(self.account_map)} accounts")
+        print(f"Note: Loaded {len(self.member_map)} members")
+        return True
+
+    def _save_snapshot(self, snapshot_file: str, input_files: list[str]) -> None:
+        if not os.path.isdir(os.path.dirname(snapshot_file) or "."):
+            return
+        state = { key: value for key, value in vars(self).items() if key not in Membership.SNAPSHOT_SKIP }
+        snapshot = { "version": SNAPSHOT_VERSION,
+                     "stamps": Membership._file_stamps(input_files),
+                     "hash": csvfile.hash_files(input_files),
+                     "state": state }
+        Membership._write_snapshot(snapshot_file, snapshot)
+
+    @staticmethod
+    def _write_snapshot(snapshot_file: str, snapshot: dict) -> None:
+        # Write to a temp file and rename so a partial write is never loaded
+        tmp_file = snapshot_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, snapshot_file)
+
+    def set_as_of_date(self, as_of_date: datetime.date) -> None:
+        """
+        Recalculate the age and minor status of all members as of a date.
+        For example, a date in next season to check who will still be a minor.
+        """
+        self.as_of_date = as_of_date
+        for member in self.all_members():
+            member.set_as_of_date(as_of_date)
+        self._build_households()
 
     def member_names(self) -> list[MemberName]:
         result: list[MemberName]
@@ -218,30 +746,40 @@ class Membership:
         """
         search for members that have semi-matching names
         """
+        result = self.find_cache.get(member_name)
+        if result is None:
+            result = self._find_members_by_name(member_name)
+            self.find_cache[member_name] = result
+        else:
+            instrument.count("names.find_cached")
+        return result
+
+    def _find_members_by_name(self, member_name: MemberName) -> list[MemberEntry]:
         result: list[MemberEntry] = []
 
         if member_name in self.member_map:
+            instrument.count("names.exact")
             return self.member_map[member_name]
 
-        for name, members in self.member_map.items():
-            if name.first_name.startswith(
-                member_name.first_name
-            ) and name.last_name.startswith(member_name.last_name):
-                result.extend(members)
+        # Names that extend the given name: "Bob J" -> "Bobby Jones"
+        for pos in self.name_index.extending(member_name):
+            result.extend(self.member_map[self.name_index.names[pos]])
         if len(result) > 0:
+            instrument.count("names.fuzzy_extending")
             return result
 
-        for name, members in self.member_map.items():
-            if member_name.first_name.startswith(
-                name.first_name
-            ) and member_name.last_name.startswith(name.last_name):
-                result.extend(members)
+        # Names that are shortened forms of the given name: "Roberto" -> "Rob"
+        for pos in self.name_index.within(member_name):
+            result.extend(self.member_map[self.name_index.names[pos]])
         if len(result) > 0:
+            instrument.count("names.fuzzy_within")
             return result
 
         for nick_name in member_name.allnames():
             if nick_name.lower() in self.member_name_map:
+                instrument.count("names.fuzzy_nickname")
                 return self.member_name_map[nick_name.lower()]
+        instrument.count("names.not_found")
         return result
 
     def find_one_member_by_name(self, member_name: MemberName) -> MemberEntry | None:
@@ -252,6 +790,102 @@ class Membership:
             print(f"Warning: found multiple members for {member_name.fullname()}")
         return members[0]
 
+    def resolve_name(self, name: str | MemberName) -> NameMatch:
+        """
+        Parse a fullname, or take a name already split in first and last name,
+        and find the best matching member.
+        Results are cached until the members are reloaded.
+        """
+        match = self.name_match_cache.get(name)
+        if match is not None:
+            return match
+
+        if isinstance(name, MemberName):
+            match = NameMatch(name.fullname(), name)
+        else:
+            match = NameMatch(name, MemberName.CreateMemberName(name))
+        saved = self.saved_name_matches.get(name)
+        if match.member_name is not None and saved is not None:
+            # Resolved by an earlier run against the same roster
+            instrument.count("names.resolved_from_cache")
+            member_id, match.ambiguous = saved
+            match.member = self.member_id_map.get(member_id)
+        elif match.member_name is not None:
+            members = self.find_members_by_name(match.member_name)
+            if len(members) > 0:
+                match.member = members[0]
+            if len(members) > 1:
+                match.ambiguous = True
+        self.name_match_cache[name] = match
+        return match
+
+    def resolve_names(self, names: Iterable[N], warn: bool = True) -> dict[N, NameMatch]:
+        """
+        Resolve a batch of fullnames or member names. Each distinct name is parsed
+        and looked up once. If warn, each occurrence of a name matching more than
+        one member is reported.
+        """
+        result: dict[N, NameMatch] = {}
+        for name in names:
+            if name not in result:
+                result[name] = self.resolve_name(name)
+            match = result[name]
+            if warn and match.ambiguous and match.member_name is not None:
+                print(f"Warning: found multiple members for {match.member_name.fullname()}")
+        return result
+
+    def load_name_cache(self, filename: str = NAME_CACHE_FILE) -> None:
+        """
+        Load name resolutions saved by an earlier run.
+        The saved entries are only used if the roster has not changed.
+        """
+        self.saved_name_matches = {}
+        if not os.path.exists(filename):
+            print(f"Note: no name cache {filename}")
+            return
+
+        with open(filename, "r") as f:
+            data = json.load(f)
+        if data.get("roster_hash") != self.roster_hash:
+            print(f"Note: roster changed, ignoring name cache {filename}")
+            return
+
+        for name, entry in data.get("names", {}).items():
+            self.saved_name_matches[name] = (entry["member_id"], entry["ambiguous"])
+        # Names from first and last name columns, saved as "first<tab>last"
+        for name, entry in data.get("member_names", {}).items():
+            first_name, last_name = name.split("\t")
+            self.saved_name_matches[MemberName(first_name, last_name)] = (entry["member_id"], entry["ambiguous"])
+        print(f"Note: loaded {len(self.saved_name_matches)} cached name matches")
+
+    def save_name_cache(self, filename: str = NAME_CACHE_FILE) -> None:
+        """
+        Save the name resolutions for the current roster for use by later runs.
+        """
+        if not os.path.isdir(os.path.dirname(filename) or "."):
+            return
+        names: dict[str, dict] = {}
+        member_names: dict[str, dict] = {}
+
+        def add(name: str | MemberName, member_id: str, ambiguous: bool) -> None:
+            entry = { "member_id": member_id, "ambiguous": ambiguous }
+            if isinstance(name, MemberName):
+                member_names[f"{name.first_name}\t{name.last_name}"] = entry
+            else:
+                names[name] = entry
+
+        for name, (member_id, ambiguous) in self.saved_name_matches.items():
+            add(name, member_id, ambiguous)
+        for name, match in self.name_match_cache.items():
+            if not match.is_parsed():
+                continue
+            add(name, match.member.member_id if match.member is not None else "", match.ambiguous)
+
+        print(f"Note: write {len(names) + len(member_names)} name matches to {filename}")
+        with open(filename, "w") as f:
+            json.dump({ "roster_hash": self.roster_hash, "names": names, "member_names": member_names },
+                      f, indent=1, sort_keys=True)
+
     def get_members_by_fullname(self, member_name: str) -> list[MemberEntry]:
         if member_name.lower() not in self.member_name_map:
             return []
@@ -312,28 +946,27 @@ class Membership:
             print("Warning: Account {account_num} does not exist.")
             return []
 
-        result = []
-        for member in self.all_members():
-            if member.account_num == account_num:
-                result.append(member)
-        return result
+        return list(self.account_members_map.get(account_num, []))
 
     def get_member_by_id(self, member_id: str) -> MemberEntry | None:
-        for members in self.member_map.values():
-            for member in members:
-                if member.member_id == member_id:
-                    return member
-        return None
+        return self.member_id_map.get(member_id)
+
+    def get_members_by_ids(self, member_ids: Iterable[str]) -> list[MemberEntry | None]:
+        """
+        Lookup a set of member ids in one call.
+        Returns entries in the same order as the ids, None for unknown ids.
+        """
+        member_id_map = self.member_id_map
+        return [member_id_map.get(member_id) for member_id in member_ids]
 
     def has_minor_children(self, account_num: str) -> bool:
         return self.number_minor_children(account_num) > 0
 
     def number_minor_children(self, account_num: str) -> int:
-        count = 0
-        for member in self.get_members_for_account_num(account_num):
-            if member.is_minor():
-                count += 1
-        return count
+        household = self.households.get(account_num)
+        if household is None:
+            return 0
+        return len(household.minors)
 
     def all_members(self) -> Iterator[MemberEntry]:
         for entries in self.member_map.values():
@@ -343,35 +976,168 @@ class Membership:
     def get_account(self, account_num: str) -> AccountEntry:
         return self.account_map[account_num]
 
+    def get_household(self, account_num: str) -> Household:
+        return self.households[account_num]
+
     def get_primary_account_member(self, account_num: str) -> MemberEntry | None:
         account_entry = self.account_map.get(account_num)
         if account_entry is None:
             print("Warning: Account {account_num} does not exist.")
             return None
 
+        return self.primary_member_map.get(account_num)
+
+    def accounts_without_primary(self) -> list[str]:
+        """
+        Accounts with no member matching the billing name
+        """
+        return [ account_num for account_num in self.account_map
+                 if self.primary_member_map.get(account_num) is None ]
+
+    def accounts_with_ambiguous_primary(self) -> list[str]:
+        """
+        Accounts with more than one member matching the billing name
+        """
+        return list(self.ambiguous_primary_accounts)
+
+    def _index_primary_members(self) -> None:
+        """
+        Find the member matching the billing name of each account.
+        The first match is used if more than one member has the name.
+        """
+        self.primary_member_map = {}
+        self.ambiguous_primary_accounts = []
+        for account_num in self.account_map:
+            self._index_primary_member(account_num)
+
+        missing = len(self.account_map) - len(self.primary_member_map)
+        if missing > 0:
+            print(f"Note: {missing} accounts have no primary member")
+        for account_num in self.ambiguous_primary_accounts:
+            print(f"Note: multiple primary members for account {account_num}")
+
+    def _index_primary_member(self, account_num: str) -> None:
+        self.primary_member_map.pop(account_num, None)
+        if account_num in self.ambiguous_primary_accounts:
+            self.ambiguous_primary_accounts.remove(account_num)
+
+        account = self.account_map.get(account_num)
+        if account is None:
+            return
+        matches = [ member for member in self.account_members_map.get(account_num, [])
+                    if member.name == account.billing_name ]
+        if len(matches) > 0:
+            self.primary_member_map[account_num] = matches[0]
+        if len(matches) > 1:
+            self.ambiguous_primary_accounts.append(account_num)
+
+    def _index_members(self) -> None:
+        """
+        Build secondary indexes over the loaded members.
+        Called whenever member_map is (re)loaded so the indexes stay in sync.
+        """
+        self._index_accounts()
+        self.name_index = NameIndex(list(self.member_map.keys()))
+        self._index_primary_members()
+        self._build_households()
+        self._clear_caches()
+
+    def _index_accounts(self) -> None:
+        # Members are indexed in all_members() order to match a full scan
+        self.account_members_map = {}
+        self.member_id_map = {}
         for member in self.all_members():
-            if member.account_num == account_num:
-                if member.name == account_entry.billing_name:
-                    return member
-        return None
+            if member.account_num not in self.account_members_map:
+                self.account_members_map[member.account_num] = []
+            self.account_members_map[member.account_num].append(member)
+
+            # Keep the first entry for an id, as a full scan would
+            if member.member_id not in self.member_id_map:
+                self.member_id_map[member.member_id] = member
+
+    def set_key_holders(self, key_holders: dict[str, bool]) -> None:
+        """
+        Record the members holding keys (member_id -> key enabled) in the households.
+        """
+        self.key_holders = key_holders
+        for household in self.households.values():
+            self._set_household_keys(household)
+
+    def _set_household_keys(self, household: Household) -> None:
+        household.key_holders = { member.member_id: self.key_holders[member.member_id]
+                                  for member in household.members
+                                  if member.member_id in self.key_holders }
+
+    def _build_households(self) -> None:
+        """
+        Group the members of each account. Depends on member ages and key holders.
+        """
+        self.households = {}
+        for account_num in self.account_map:
+            self._build_household(account_num)
+
+    def _build_household(self, account_num: str) -> None:
+        self.households.pop(account_num, None)
+        if account_num not in self.account_map:
+            return
+
+        household = Household(account_num)
+        household.primary = self.primary_member_map.get(account_num)
+        for member in self.account_members_map.get(account_num, []):
+            household.members.append(member)
+            if member.is_minor():
+                household.minors.append(member)
+                if member.has_birthdate():
+                    if household.min_minor_age is None or member.age() < household.min_minor_age:
+                        household.min_minor_age = member.age()
+                    if household.max_minor_age is None or member.age() > household.max_minor_age:
+                        household.max_minor_age = member.age()
+            else:
+                household.adults.append(member)
+            if member.is_caretaker_type():
+                household.caretakers.append(member)
+        self._set_household_keys(household)
+        self.households[account_num] = household
+
+    def _clear_caches(self) -> None:
+        self.find_cache = {}
+        self.name_match_cache = {}
 
     def _read_members_csv(self, filename):
-        print(f"Note: reading member list '{filename}'")
         self.member_map = {}
         self.member_name_map = {}
+        for member in self._parse_members_csv(filename, self.account_map):
+            self._add_member_name(member)
+
+        self._index_members()
+
+        print(f"Note: Loaded {len(self.member_map)} members")
+
+        for entries in self.member_map.values():
+            if len(entries) > 1:
+                name = entries[0].name
+                print(f"Note: multiple entries ({len(entries)}) for {name}")
+
+    def _parse_members_csv(self, filename: str, account_map: dict[str, AccountEntry]) -> list[MemberEntry]:
+        """
+        Read the member entries for the accounts in account_map
+        """
+        print(f"Note: reading member list '{filename}'")
+        result: list[MemberEntry] = []
         count = 0
         with open(filename, newline="", encoding="utf-8-sig") as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
                 count += 1
-                account_num = row[MemberEntry.FIELD_ACCOUNT_NUM].strip()
+                # Intern repeated strings so members of an account share them
+                account_num = sys.intern(row[MemberEntry.FIELD_ACCOUNT_NUM].strip())
                 name = MemberName(
                     row[MemberEntry.FIELD_FIRST_NAME].strip(),
-                    row[MemberEntry.FIELD_LAST_NAME].strip(),
+                    sys.intern(row[MemberEntry.FIELD_LAST_NAME].strip()),
                 )
 
                 # Check account is active
-                if account_num not in self.account_map:
+                if account_num not in account_map:
                     # print(f"Skipping member {name}")
                     continue
 
@@ -391,41 +1157,48 @@ class Membership:
                     name,
                     account_num,
                     row[MemberEntry.FIELD_MEMBER_ID].strip(),
-                    row[MemberEntry.FIELD_MEMBER_TYPE].strip(),
-                    row[MemberEntry.FIELD_EMAIL].strip(),
+                    MemberType.from_label(row[MemberEntry.FIELD_MEMBER_TYPE].strip()),
+                    sys.intern(row[MemberEntry.FIELD_EMAIL].strip()),
                     birthdate,
+                    self.as_of_date,
                 )
-                if name not in self.member_map:
-                    self.member_map[name] = []
-                self.member_map[name].append(member)
-
-                for nick_name in name.allnames():
-                    if nick_name.lower() not in self.member_name_map:
-                        self.member_name_map[nick_name.lower()] = []
-                    self.member_name_map[nick_name.lower()].append(member)
+                result.append(member)
 
                 # Birthday stuff
                 # if member.hasBirthdate():
                 #    print(f"Member {member.name} born {member.birthdate} age {member.age()}")
 
         print(f"Note: Read {count} member sheet rows")
-        print(f"Note: Loaded {len(self.member_map)} members")
+        return result
 
-        for entries in self.member_map.values():
-            if len(entries) > 1:
-                name = entries[0].name
-                print(f"Note: multiple entries ({len(entries)}) for {name}")
+    def _add_member_name(self, member: MemberEntry) -> None:
+        """
+        Add a member to the name maps
+        """
+        if member.name not in self.member_map:
+            self.member_map[member.name] = []
+        self.member_map[member.name].append(member)
+
+        for nick_name in member.name.allnames():
+            key = sys.intern(nick_name.lower())
+            if key not in self.member_name_map:
+                self.member_name_map[key] = []
+            self.member_name_map[key].append(member)
 
     def _read_accounts_csv(self, filename: str):
-        print(f"Note: reading account list '{filename}'")
         # Build dictionary of { account_num : AccountEntry }
-        self.account_map = {}
+        self.account_map = self._parse_accounts_csv(filename)
+        print(f"Note: Loaded {len(self.account_map)} accounts")
+
+    def _parse_accounts_csv(self, filename: str) -> dict[str, AccountEntry]:
+        print(f"Note: reading account list '{filename}'")
+        result: dict[str, AccountEntry] = {}
         count = 0
         with open(filename, newline="", encoding="utf-8-sig") as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
                 count += 1
-                account_num = row[AccountEntry.FIELD_ACCOUNT_NUM].strip()
+                account_num = sys.intern(row[AccountEntry.FIELD_ACCOUNT_NUM].strip())
                 account_type = row[AccountEntry.FIELD_ACCOUNT_TYPE].strip()
                 billing_first = row[AccountEntry.FIELD_FIRST_NAME].strip()
                 billing_last = row[AccountEntry.FIELD_LAST_NAME].strip()
@@ -440,10 +1213,10 @@ class Membership:
                     MemberName(billing_first, billing_last),
                     billing_email,
                 )
-                self.account_map[account_num] = entry
+                result[account_num] = entry
 
         print(f"Note: Read {count} account sheet rows")
-        print(f"Note: Loaded {len(self.account_map)} accounts")
+        return result
 
     def _read_parents_csv(self, filename: str):
         print(f"Reading parents list '{filename}")
@@ -481,6 +1254,10 @@ class Membership:
                 # print(f"Add parent rec for account {account_num}")
 
     def _read_dues_csv(self, filename: str):
+        # Accounts kept by a reload may have been paid in an earlier dues file
+        for account in self.account_map.values():
+            account.paid = False
+
         if not os.path.exists(filename):
             print("Skip reading dues tracking - no file")
             return
@@ -532,8 +1309,130 @@ def test() -> None:
     assert(name.first_name == "William")
     assert(name.last_name == "Fong Jones")
 
+    names = [ MemberName("Robert", "Jones"), MemberName("Rob", "Jones"), MemberName("Bob", "Jones") ]
+    index = NameIndex(names)
+    assert(index.extending(MemberName("Rob", "J")) == [0, 1])
+    assert(index.within(MemberName("Roberto", "Jones")) == [0, 1])
+    assert(index.within(MemberName("Ann", "Jones")) == [])
+
+    member = MemberEntry(MemberName("Sam", "Jones"), "1", "1", MemberType.CHILD, "", datetime.date(2008, 6, 1),
+                         datetime.date(2026, 5, 31))
+    assert(member.age() == 17 and member.is_minor())
+    member.set_as_of_date(datetime.date(2026, 6, 1))
+    assert(member.age() == 18 and not member.is_minor())
+
+
+def roster_state(membership: Membership) -> dict:
+    """
+    Loaded data as member ids in order, to compare two loads of the roster
+    """
+    def ids(members: Iterable[MemberEntry | None]) -> list[str | None]:
+        return [ member.member_id if member is not None else None for member in members ]
+
+    return { "accounts": [ (account.account_num, account.paid) for account in membership.accounts() ],
+             "members": [ (str(name), ids(entries)) for name, entries in membership.member_map.items() ],
+             "names": { key: ids(entries) for key, entries in membership.member_name_map.items() },
+             "account_members": { account_num: ids(entries)
+                                  for account_num, entries in membership.account_members_map.items() },
+             "member_ids": sorted(membership.member_id_map),
+             "primary": { account_num: ids([membership.get_primary_account_member(account_num)])
+                          for account_num in membership.account_nums() },
+             "ambiguous": sorted(membership.accounts_with_ambiguous_primary()),
+             "households": { account_num: (ids(household.members), ids(household.minors), ids(household.adults),
+                                           sorted(household.key_holders.items()))
+                             for account_num, household in membership.households.items() },
+             "families": { account_num: [ (ids(rec.parents), ids(rec.minors)) for rec in recs ]
+                           for account_num, recs in membership.parent_map.items() },
+             "found": ids(membership.find_members_by_name(MemberName("Ann", "Smith"))) }
+
+
+def test_reload() -> None:
+    """
+    Check that reloading changed files gives the same data as reading them
+    """
+    import tempfile
+
+    accounts = [ "Acct #,Acct Type,First Name,Last Name,Email,Street Address",
+                 "1,Proprietary Member Annual,Ann,Smith,ann@x.org,1 A St",
+                 "2,Proprietary Member Annual,Bob,Jones,bob@x.org,2 B St",
+                 "3,Proprietary Member Annual,Carol,Lee,carol@x.org,3 C St" ]
+    members = [ "Acct #,Member ID,Member Type,First Name,Last Name,Birthdate,Email",
+                "1,10,Adult,Ann,Smith,1980-01-01,ann@x.org",
+                "1,11,Adult,Ann,Smith,1985-01-01,",
+                "1,12,Child,Tim,Smith,2015-01-01,",
+                "2,20,Adult,Bob,Jones,1970-01-01,bob@x.org",
+                "2,21,Child,Sue,Jones,2012-05-05,",
+                "3,30,Adult,Carol,Lee,1990-01-01,carol@x.org",
+                "3,31,Adult,Ann,Smith,1990-02-02," ]
+    families = [ "Acct #,Parent1,Parent2,Minor1,Minor2,Minor3,Minor4,Minor5",
+                 "2,Bob Jones,,Sue Jones,,,," ]
+    dues = [ "Acct,Last Name,Payment Status",
+             "1,Smith,Yes",
+             "2,Jones,Yes" ]
+    key_holders = { "10": True, "21": False, "32": True }
+    # Changes applied in turn, each compared with a full read
+    steps: list[tuple[str, list[str], list[str]]] = [
+        # Same members in another order changes the primary member
+        ("reorder", [ members[0], members[2], members[1] ] + members[3:], dues),
+        # Account no longer listed in the dues file
+        ("dues", [ members[0], members[2], members[1] ] + members[3:], dues[:2]),
+        # Members added, removed and changed, and another account's member listed first
+        ("edit", [ members[0], members[7], members[2], members[1], members[3],
+                   "2,21,Child,Sue,Jones,2011-05-05,", members[6],
+                   "3,32,Child,Amy,Lee,2016-03-03," ], dues),
+    ]
+
+    def write(filename: str, lines: list[str]) -> None:
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        accounts_file = os.path.join(tmpdir, "accounts.csv")
+        members_file = os.path.join(tmpdir, "members.csv")
+        parents_file = os.path.join(tmpdir, "families.csv")
+        dues_file = os.path.join(tmpdir, "dues.csv")
+        files = [ accounts_file, members_file, parents_file, dues_file ]
+        snapshot_file = os.path.join(tmpdir, "membership.pickle")
+        as_of_date = datetime.date(2026, 6, 1)
+        write(accounts_file, accounts)
+        write(members_file, members)
+        write(parents_file, families)
+        write(dues_file, dues)
+        Membership().read_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                    snapshot_file=snapshot_file, as_of_date=as_of_date)
+
+        for step, step_members, step_dues in steps:
+            write(members_file, step_members)
+            write(dues_file, step_dues)
+            # Make sure the snapshot is seen as out of date
+            for filename in files:
+                os.utime(filename, ns=(0, os.stat(filename).st_mtime_ns + 1_000_000_000))
+
+            # Key holders are kept across the reload
+            reloaded = Membership()
+            reloaded.set_key_holders(key_holders)
+            changes = reloaded.update_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                                snapshot_file=snapshot_file, as_of_date=as_of_date)
+            assert changes is not None, step
+            if step == "reorder":
+                assert changes.accounts_reordered == ["1"], changes
+            read = Membership()
+            read.read_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                snapshot_file=None, as_of_date=as_of_date)
+            read.set_key_holders(key_holders)
+            restored = Membership()
+            restored.read_csv_files(accounts_file, members_file, parents_file, dues_file,
+                                snapshot_file=snapshot_file, as_of_date=as_of_date)
+            restored.set_key_holders(key_holders)
+            assert roster_state(reloaded) == roster_state(read), step
+            assert roster_state(restored) == roster_state(read), step
+
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        test()
+        test_reload()
+        sys.exit(0)
     test()
     members = Membership()
     members.read_csv_files(ACCOUNTS_TEST_CSV, MEMBERS_TEST_1_CSV, PARENTS_TEST_CSV)
@@ -0,0 +1,130 @@
+"""
+Cache of parsed documents, keyed by the content of the PDF.
+
+The result of parsing each document is saved under the sha256 of the PDF and
+the version of the parser that produced it. A renamed or uploaded again
+document is found by its content without downloading it, and when a parser
+changes only the documents parsed by an older version are parsed again.
+
+Each kind of document has its own file: data/parse_cache_<kind>.json
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+from typing import Callable, Generic, TypeVar
+
+import instrument
+
+
+CACHE_DIR = "data"
+
+T = TypeVar("T")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ParseCache(Generic[T]):
+    """
+    Parsed documents of one kind by content hash. Documents are stored as
+    dicts made by encode and returned as made by decode.
+    """
+
+    def __init__(self, kind: str, version: str,
+                 encode: Callable[[T], dict], decode: Callable[[dict], T],
+                 cache_dir: str = CACHE_DIR) -> None:
+        self.kind = kind
+        self.version = version
+        self.encode = encode
+        self.decode = decode
+        self.filename = os.path.join(cache_dir, f"parse_cache_{kind}.json")
+        self.entries: dict[str, dict] = self.load()
+        self.changed = False
+
+    def load(self) -> dict[str, dict]:
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: unable to read '{self.filename}': {e}")
+            return {}
+
+    def save(self) -> None:
+        if not self.changed or not os.path.isdir(os.path.dirname(self.filename) or "."):
+            return
+        tmp_file = self.filename + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.filename)
+        self.changed = False
+
+    def get(self, sha256: str) -> T | None:
+        """
+        Return the document parsed from content with the hash by this version of the parser
+        """
+        entry = self.entries.get(sha256)
+        if entry is None or entry.get("version") != self.version:
+            instrument.count(f"parse_cache.{self.kind}_misses")
+            return None
+        instrument.count(f"parse_cache.{self.kind}_hits")
+        return self.decode(entry["document"])
+
+    def put(self, sha256: str, document: T) -> None:
+        """
+        Save a parsed document, replacing the result of an older parser version
+        """
+        self.entries[sha256] = { "version": self.version, "document": self.encode(document) }
+        self.changed = True
+
+
+def test() -> None:
+    """
+    Check reading and saving parsed documents and replacing older versions
+    """
+    import tempfile
+
+    def encode(document: list[str]) -> dict:
+        return { "lines": document }
+
+    def decode(data: dict) -> list[str]:
+        return list(data["lines"])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first = content_hash(b"first")
+        second = content_hash(b"second")
+        cache = ParseCache("test", "1", encode, decode, tmpdir)
+        assert cache.get(first) is None
+        cache.put(first, [ "a" ])
+        assert cache.get(first) == [ "a" ]
+        cache.save()
+        assert not cache.changed
+
+        # Read back by the same version only
+        cache = ParseCache("test", "1", encode, decode, tmpdir)
+        assert cache.get(first) == [ "a" ] and cache.get(second) is None
+        cache = ParseCache("test", "2", encode, decode, tmpdir)
+        assert cache.get(first) is None
+        cache.put(first, [ "b" ])
+        cache.put(second, [ "c" ])
+        cache.save()
+        cache = ParseCache("test", "2", encode, decode, tmpdir)
+        assert cache.get(first) == [ "b" ] and cache.get(second) == [ "c" ]
+
+        # Unchanged cache is not written, an unreadable one is empty
+        modified = os.stat(cache.filename).st_mtime_ns
+        cache.save()
+        assert os.stat(cache.filename).st_mtime_ns == modified
+        with open(cache.filename, "w") as f:
+            f.write("{")
+        assert ParseCache("test", "2", encode, decode, tmpdir).entries == {}
+        assert ParseCache("test", "2", encode, decode, os.path.join(tmpdir, "missing")).entries == {}
+
+
+if __name__ == "__main__":
+    test()
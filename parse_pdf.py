@@ -6,15 +6,35 @@ Parse information from PDF files
 Extract name of people that signed the waiver, any minor age persons listed, and date completed.
 """
 
+from __future__ import annotations
+
 import io
+import os
 import re
 import sys
+import concurrent.futures
 from dataclasses import dataclass
+from typing import Callable, TypeVar
 
 import pdfplumber
 
 import dateutil
 import docs
+import instrument
+import parse_cache
+import pdf_templates
+
+
+def count_pdf(kind: str, infile: io.BufferedReader | io.BytesIO, pdf: pdfplumber.PDF) -> None:
+    """
+    Count a document opened for parsing, its pages and size
+    """
+    position = infile.tell()
+    size = infile.seek(0, io.SEEK_END)
+    infile.seek(position)
+    instrument.count(f"pdf.{kind}_parsed")
+    instrument.count("pdf.pages", len(pdf.pages))
+    instrument.count("pdf.bytes_read", size)
 
 
 @dataclass
@@ -43,88 +63,69 @@ class MemberWaiverPDF:
             result += f"\n\t{minor}"
         return result
 
+    def to_dict(self) -> dict:
+        return { "signatures": [ [ signature.name, signature.date ] for signature in self.signatures ],
+                 "minors": self.minors }
 
+    @staticmethod
+    def from_dict(data: dict) -> MemberWaiverPDF:
+        waiver = MemberWaiverPDF()
+        waiver.signatures = [ Signature(name, date) for name, date in data["signatures"] ]
+        waiver.minors = list(data["minors"])
+        return waiver
+
+
+# Field boxes on page 2 of a member waiver: (x0, top, x1, bottom)
+MEMBER_WAIVER_BOXES: list[tuple[str, pdf_templates.Box]] = [
+    ("signature_1_name", (66, 162, 240, 166)),
+    ("signature_1_date", (93, 230, 230, 233)),
+    ("signature_2_name", (320, 158, 500, 165)),
+    ("signature_2_date", (344, 230, 465, 231)),
+    # Minors, in the order they are listed
+    ("minors", (57, 419, 180, 425)),
+    ("minors", (57, 452, 180, 457)),
+    ("minors", (57, 485, 180, 490)),
+    ("minors", (57, 518, 180, 522)),
+    ("minors", (57, 558, 180, 562)),
+    # child 6
+    ("minors", (209, 424, 333, 428)),
+    # child 7
+    ("minors", (210, 484, 330, 488)),
+    # child 8
+    ("minors", (210, 452, 330, 457)),
+    # child 9
+    ("minors", (210, 517, 330, 521)),
+]
+
+pdf_templates.register(pdf_templates.Template(
+    kind="member", version=1, page=1, boxes=MEMBER_WAIVER_BOXES,
+    fields={ name: "list" if name == "minors" else "text" for name, _ in MEMBER_WAIVER_BOXES }))
+
+
+@instrument.timed("parse_pdf.member_waiver")
 def parse_member_waiver_pdf(infile: io.BufferedReader | io.BytesIO) -> MemberWaiverPDF:
     """
     Read a member waiver PDF and specific key data.
     """
     waiver = MemberWaiverPDF()
     with pdfplumber.open(infile) as pdf:
-        if len(pdf.pages) < 2:
+        count_pdf("member_waiver", infile, pdf)
+        document = pdf_templates.Document(pdf)
+        template = pdf_templates.select("member", document)
+        if template is None:
             return waiver
-        page = pdf.pages[1]
-
-        # 1st signature
-        cpage = page.crop((66, 162, 240, 166))
-        name = cpage.extract_text_simple().strip()
-        cpage = page.crop((93, 230, 230, 233))
-        date = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.signatures.append(Signature(name, date))
-
-        # 2nd signature
-        cpage = page.crop((320, 158, 500, 165))
-        name = cpage.extract_text_simple().strip()
-        cpage = page.crop((344, 230, 465, 231))
-        date = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.signatures.append(Signature(name, date))
-
-        # Minors
-        # 1
-        cpage = page.crop((57, 419, 180, 425))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # 2
-        cpage = page.crop((57, 452, 180, 457))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # 3
-        cpage = page.crop((57, 485, 180, 490))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # 4
-        cpage = page.crop((57, 518, 180, 522))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # child 5
-        cpage = page.crop((57, 558, 180, 562))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
+        values = template.extract(document)
 
-        # child 6
-        cpage = page.crop((209, 424, 333, 428))
-        name = cpage.extract_text_simple().strip()
+    # Signatures
+    number = 1
+    while f"signature_{number}_name" in values.texts:
+        name = values.texts[f"signature_{number}_name"]
         if len(name) > 0:
-            waiver.minors.append(name)
-
-        # child 7
-        cpage = page.crop((210, 484, 330, 488))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # child 8
-        cpage = page.crop((210, 452, 330, 457))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
-
-        # child 9
-        cpage = page.crop((210, 517, 330, 521))
-        name = cpage.extract_text_simple().strip()
-        if len(name) > 0:
-            waiver.minors.append(name)
+            waiver.signatures.append(Signature(name, values.texts.get(f"signature_{number}_date", "")))
+        number += 1
 
+    # Minors
+    waiver.minors.extend(values.lists.get("minors", []))
     return waiver
 
 
@@ -144,6 +145,17 @@ class GuestWaiverPDF:
             result += f"\n\t{minor}"
         return result
 
+    def to_dict(self) -> dict:
+        return { "adult": self.adult, "minors": self.minors, "date": self.date }
+
+    @staticmethod
+    def from_dict(data: dict) -> GuestWaiverPDF:
+        waiver = GuestWaiverPDF()
+        waiver.adult = data["adult"]
+        waiver.minors = list(data["minors"])
+        waiver.date = data["date"]
+        return waiver
+
 
 # Strings in the PDF file to scrape
 GUEST_MARKERS = [
@@ -154,46 +166,35 @@ GUEST_MARKERS = [
     "[Print Name]",
     "[Print Name]",
 ]
+# Field of the line after each marker
+GUEST_MARKER_FIELDS = [ "", "adult", "minors", "minors", "minors", "minors" ]
 GUEST_EXCLUDE_STR = "_____________________________"
 GUEST_DATE_STR = "The document has been completed."
 
+pdf_templates.register(pdf_templates.Template(
+    kind="guest", version=1, fields={ "adult": "text", "minors": "list", "date": "text" },
+    markers=GUEST_MARKERS, marker_fields=GUEST_MARKER_FIELDS,
+    exclude={ "minors": [ GUEST_EXCLUDE_STR ] }, before={ "date": GUEST_DATE_STR }))
+
 
+@instrument.timed("parse_pdf.guest_waiver")
 def parse_guest_waiver_pdf(in_file: io.BufferedReader | io.BytesIO) -> GuestWaiverPDF:
     """
     Read a PDF file and extract specific lines
 
     """
     waiver = GuestWaiverPDF()
-    lines = []
     with pdfplumber.open(in_file) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text_simple()
-            lines.extend(text.split("\n"))
-
-    marker = 0
-    marker_found = False
-    adult = True
-
-    for line in lines:
-        # print(line)
-        if marker < len(GUEST_MARKERS) and GUEST_MARKERS[marker] == line.strip():
-            # print(f"found marker {GUEST_MARKERS[marker]}")
-            marker_found = True
-            marker += 1
-        elif marker_found:
-            marker_found = False
-            if len(line.strip()) > 0:
-                if marker == 2:
-                    waiver.adult = line.strip()
-                elif marker > 2 and line.strip() != GUEST_EXCLUDE_STR:
-                    waiver.minors.append(line.strip())
-        else:
-            # Look for DATE_STR
-            m = re.search(GUEST_DATE_STR, line.strip())
-            if m is not None:
-                # print(f"found GUEST_DATE_STR {m}")
-                waiver.date = line[0 : m.span()[0]]
+        count_pdf("guest_waiver", in_file, pdf)
+        document = pdf_templates.Document(pdf)
+        template = pdf_templates.select("guest", document)
+        if template is None:
+            return waiver
+        values = template.extract(document)
 
+    waiver.adult = values.texts.get("adult", "")
+    waiver.minors.extend(values.lists.get("minors", []))
+    waiver.date = values.texts.get("date", "")
     return waiver
 
 
@@ -218,6 +219,19 @@ class AttestationPDF:
             result += "\n\t" + minor
         return result
 
+    def to_dict(self) -> dict:
+        """
+        Parsed lines, the file name and link are set by the caller
+        """
+        return { "adults": self.adults, "minors": self.minors }
+
+    @staticmethod
+    def from_dict(data: dict) -> AttestationPDF:
+        attestation = AttestationPDF()
+        attestation.adults = list(data["adults"])
+        attestation.minors = list(data["minors"])
+        return attestation
+
     def parse_attestation(self) -> docs.Attestation:
         """
         Parse lines from the PDF file and return an Attestation class
@@ -279,8 +293,15 @@ markers = [
     "Minor 4",
     "Minor 5",
 ]
+# Field of the line after each marker
+marker_fields = [ "adults" ] * 4 + [ "minors" ] * 5
+
+pdf_templates.register(pdf_templates.Template(
+    kind="attest", version=1, fields={ "adults": "list", "minors": "list" },
+    markers=markers, marker_fields=marker_fields))
 
 
+@instrument.timed("parse_pdf.attestation")
 def parse_attestation_pdf(in_file: io.BufferedReader | io.BytesIO) -> AttestationPDF:
     """
     Read a PDF file and extract specific lines
@@ -288,40 +309,253 @@ def parse_attestation_pdf(in_file: io.BufferedReader | io.BytesIO) -> Attestatio
     Note: mostly works. Will fail when values wrap to two lines.
     """
     attestation = AttestationPDF()
-    lines = []
     with pdfplumber.open(in_file) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text_simple()
-            lines.extend(text.split("\n"))
-
-    marker = 0
-    marker_found = False
-    adult = True
-
-    for line in lines:
-        # print(line)
-        if marker < len(markers) and markers[marker] == line.strip():
-            # print(f"found marker {markers[marker]}")
-            marker_found = True
-            if marker > 3:
-                adult = False
-            marker += 1
-        elif marker_found:
-            marker_found = False
-            if len(line.strip()) > 0:
-                if adult:
-                    attestation.adults.append(line.strip())
-                else:
-                    attestation.minors.append(line.strip())
-
+        count_pdf("attestation", in_file, pdf)
+        document = pdf_templates.Document(pdf)
+        template = pdf_templates.select("attest", document)
+        if template is None:
+            return attestation
+        values = template.extract(document)
+
+    attestation.adults.extend(values.lists.get("adults", []))
+    attestation.minors.extend(values.lists.get("minors", []))
     return attestation
 
 
+# Revisions of the forms added without code changes
+pdf_templates.load_file()
+
+
+ParsedPDF = MemberWaiverPDF | GuestWaiverPDF | AttestationPDF
+
+# Parser for each kind of document
+PARSERS: dict[str, Callable[[io.BufferedReader | io.BytesIO], ParsedPDF]] = {
+    "member": parse_member_waiver_pdf,
+    "guest": parse_guest_waiver_pdf,
+    "attest": parse_attestation_pdf,
+}
+
+# Version of the code of each parser. Increase it when a change alters the
+# documents parsed, so cached results of the earlier version are not used.
+PARSER_VERSIONS = {
+    "member": 1,
+    "guest": 1,
+    "attest": 1,
+}
+
+# Documents parsed for each kind, read back from the parse cache with from_dict
+DOCUMENT_TYPES: dict[str, type[ParsedPDF]] = {
+    "member": MemberWaiverPDF,
+    "guest": GuestWaiverPDF,
+    "attest": AttestationPDF,
+}
+
+D = TypeVar("D", bound=ParsedPDF)
+
+
+def parser_version(kind: str) -> str:
+    """
+    Version of the parser of a kind of document and the templates it uses
+    """
+    return f"{PARSER_VERSIONS[kind]}/{pdf_templates.version(kind)}"
+
+
+def encode_document(document: ParsedPDF) -> dict:
+    return document.to_dict()
+
+
+def open_cache(kind: str, decode: Callable[[dict], D]) -> parse_cache.ParseCache[D]:
+    """
+    Open the cache of parsed documents of a kind for the current parser version.
+    decode is the from_dict of the documents of the kind.
+    """
+    return parse_cache.ParseCache(kind, parser_version(kind), encode_document, decode)
+
+
+# Defaults for parse_many
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_CHUNKSIZE = 4
+
+
+@dataclass
+class ParseResult:
+    """
+    Result of parsing one document of a batch
+    """
+    source: str
+    document: ParsedPDF | None
+    error: str = ""
+
+    def ok(self) -> bool:
+        return self.document is not None
+
+
+def parse_document(kind: str, blob: bytes | str) -> ParsedPDF:
+    """
+    Parse a document held in memory or in a local file
+    """
+    if isinstance(blob, str):
+        with open(blob, "rb") as f:
+            return PARSERS[kind](f)
+    return PARSERS[kind](io.BytesIO(blob))
+
+
+def _parse_one(kind: str, index: int, blob: bytes | str) -> ParseResult:
+    """
+    Parse a document of a batch, runs in a worker process.
+    Errors are returned rather than raised so they do not stop the batch.
+    """
+    source = blob if isinstance(blob, str) else f"document {index}"
+    try:
+        return ParseResult(source, parse_document(kind, blob))
+    except Exception as e:
+        return ParseResult(source, None, f"{type(e).__name__}: {e}")
+
+
+def parse_many(kind: str, blobs: list[bytes | str],
+               workers: int = PARSE_WORKERS, chunksize: int = PARSE_CHUNKSIZE,
+               use_cache: bool = False) -> list[ParseResult]:
+    """
+    Parse a batch of documents of one kind in a pool of processes.
+    Each blob is the content of a PDF or the name of a local PDF file.
+    Results are in the order of the blobs. Failures are reported and returned
+    as results without a document.
+    With use_cache, documents parsed before by the same parser version are
+    read from the parse cache, and the new results are saved to it.
+    """
+    if kind not in PARSERS:
+        raise ValueError(f"unknown kind of document '{kind}', expected one of {list(PARSERS)}")
+
+    results: list[ParseResult | None] = [ None ] * len(blobs)
+    hashes: list[str] = []
+    cache = open_cache(kind, DOCUMENT_TYPES[kind].from_dict) if use_cache else None
+    if cache is not None:
+        for index, blob in enumerate(blobs):
+            if isinstance(blob, str):
+                with open(blob, "rb") as f:
+                    hashes.append(parse_cache.content_hash(f.read()))
+            else:
+                hashes.append(parse_cache.content_hash(blob))
+            document = cache.get(hashes[index])
+            if document is not None:
+                source = blob if isinstance(blob, str) else f"document {index}"
+                results[index] = ParseResult(source, document)
+
+    indexes = [ index for index, result in enumerate(results) if result is None ]
+    todo = [ blobs[index] for index in indexes ]
+    if workers <= 1 or len(todo) <= 1:
+        parsed = [ _parse_one(kind, index, blob) for index, blob in zip(indexes, todo) ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(_parse_one, [kind] * len(todo), indexes, todo, chunksize=chunksize))
+    for index, result in zip(indexes, parsed):
+        results[index] = result
+        if cache is not None and result.document is not None:
+            cache.put(hashes[index], result.document)
+    if cache is not None:
+        cache.save()
+
+    for result in parsed:
+        if not result.ok():
+            print(f"Error: unable to parse {result.source}: {result.error}")
+    return [ result for result in results if result is not None ]
+
+
+# Documents to check the parsers with and the data read from each
+TEST_PDFS = {
+    "member": ("test/member_waiver.test.pdf",
+               { "signatures": [ [ "Alice Smith", "05/01/2026" ], [ "Bob Smith", "05/02/2026" ] ],
+                 "minors": [ "Carol Smith", "Dan Smith" ] }),
+    "guest": ("test/guest_waiver.test.pdf",
+              { "adult": "Erin Jones", "minors": [ "Frank Jones" ], "date": "06/01/2026 10:00 " }),
+    "attest": ("test/attestation.test.pdf",
+               { "adults": [ "Grace Lee grace@example.com 01/02/1980", "Heidi Lee heidi@example.com 03/04/1982" ],
+                 "minors": [ "Ivan Lee 05/06/2015" ] }),
+}
+
+
+def test() -> None:
+    """
+    Parse the test documents one at a time and in batches
+    """
+    import tempfile
+    import dataclasses
+
+    broken = b"%PDF-1.4 broken"
+    for kind, (filename, expected) in TEST_PDFS.items():
+        assert encode_document(parse_document(kind, filename)) == expected, kind
+
+        with open(filename, "rb") as f:
+            data = f.read()
+        blobs: list[bytes | str] = [ filename, broken, data, filename ]
+        for workers in [ 1, 2 ]:
+            results = parse_many(kind, blobs, workers=workers, chunksize=1)
+            assert [ result.source for result in results ] == [ filename, "document 1", "document 2", filename ]
+            assert [ result.ok() for result in results ] == [ True, False, True, True ]
+            assert results[1].error != ""
+            for result in [ results[0], results[2], results[3] ]:
+                assert result.document is not None and encode_document(result.document) == expected, kind
+
+    try:
+        parse_many("unknown", [])
+        assert False
+    except ValueError:
+        pass
+
+    # Documents parsed before are read from the cache of the current version
+    cwd = os.getcwd()
+    member_file = os.path.abspath(TEST_PDFS["member"][0])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            os.mkdir(parse_cache.CACHE_DIR)
+            # The broken document is looked up on each run and never saved
+            for hits, misses in [ (0, 2), (1, 1) ]:
+                instrument.reset()
+                results = parse_many("member", [ member_file, broken ], workers=1, use_cache=True)
+                assert [ result.ok() for result in results ] == [ True, False ]
+                assert results[0].document is not None
+                assert encode_document(results[0].document) == TEST_PDFS["member"][1]
+                assert instrument.counters.get("parse_cache.member_hits", 0) == hits
+                assert instrument.counters.get("parse_cache.member_misses", 0) == misses
+            # A changed template is a new version
+            template = pdf_templates.templates["member"][0].template
+            pdf_templates.register(dataclasses.replace(template, exclude={ "minors": [ "Dan Smith" ] }))
+            instrument.reset()
+            results = parse_many("member", [ member_file ], workers=1, use_cache=True)
+            assert instrument.counters.get("parse_cache.member_misses", 0) == 1
+            assert results[0].document is not None and results[0].document.minors == [ "Carol Smith" ]
+            pdf_templates.register(template)
+        finally:
+            os.chdir(cwd)
+
+
 if __name__ == "__main__":
-    options = ["member", "guest", "attest"]
-    if len(sys.argv) != 3 or sys.argv[1] not in options:
-        print(f"Usage parse_pdf {options} <filename>")
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        test()
+        sys.exit(0)
+    options = list(PARSERS)
+    # Read and save the documents of a batch in the parse cache
+    use_cache = "cache" in sys.argv
+    if use_cache:
+        sys.argv.remove("cache")
+    if len(sys.argv) < 3 or sys.argv[1] not in options:
+        print(f"Usage parse_pdf {options} [cache] <filename or directory> ...")
         sys.exit(-1)
+    if len(sys.argv) > 3 or os.path.isdir(sys.argv[2]) or use_cache:
+        # Parse a set of files, such as an archive of a past year
+        filenames: list[bytes | str] = []
+        for name in sys.argv[2:]:
+            if os.path.isdir(name):
+                filenames.extend(sorted(os.path.join(name, entry) for entry in os.listdir(name)
+                                        if entry.lower().endswith(".pdf")))
+            else:
+                filenames.append(name)
+        for result in parse_many(sys.argv[1], filenames, use_cache=use_cache):
+            if result.document is not None:
+                print(f"{result.source}")
+                print(result.document)
+        sys.exit(0)
     with open(sys.argv[2], "rb") as f:
         if sys.argv[1] == "guest":
             guest_waiver_pdf = parse_guest_waiver_pdf(f)
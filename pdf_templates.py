@@ -0,0 +1,366 @@
+"""
+Templates describing where the data of each kind of PDF document is found.
+
+A template is declared for each kind of document and revision of its form:
+  - fingerprint: page count and lines of text that identify the revision
+  - boxes: named boxes on one page, the text in each box is a field value
+  - markers: lines of text, the line after each marker is a field value
+  - fields: the type of each field, "text" for one value or "list"
+
+Templates are compiled once when registered. The boxes of a template are
+indexed so the characters of the page are matched to all boxes in one pass.
+Each document is parsed with the newest registered template of its kind whose
+fingerprint matches. A new revision of a form can be added as a template in
+TEMPLATE_FILE rather than code:
+
+  [ { "kind": "member", "version": 2, "fingerprint": ["Waiver 2027"],
+      "fields": { "signature_1_name": "text", "minors": "list" },
+      "page": 1, "boxes": [ ["signature_1_name", [66, 162, 240, 166]],
+                            ["minors", [57, 419, 180, 425]] ] } ]
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sys
+import json
+import hashlib
+import dataclasses
+from dataclasses import dataclass, field
+
+import pdfplumber
+
+import instrument
+
+
+TEMPLATE_FILE = "data/pdf_templates.json"
+FIELD_TYPES = [ "text", "list" ]
+# Height of the bands used to match characters to field boxes
+FIELD_BAND_HEIGHT = 10
+
+# Box on a page: (x0, top, x1, bottom)
+Box = tuple[float, float, float, float]
+
+
+@dataclass
+class Template:
+    """
+    Declaration of where the fields of a kind and version of document are found
+    """
+    kind: str
+    version: int
+    # Type of each field: "text" or "list"
+    fields: dict[str, str]
+    # Lines of text the document must contain, none to match any document
+    fingerprint: list[str] = field(default_factory=list)
+    min_pages: int = 0
+    # Page of the boxes and the field each box is read into
+    page: int = 0
+    boxes: list[tuple[str, Box]] = field(default_factory=list)
+    # Marker lines in order of appearance and the field of the line after each, "" for none
+    markers: list[str] = field(default_factory=list)
+    marker_fields: list[str] = field(default_factory=list)
+    # Values never read into a field
+    exclude: dict[str, list[str]] = field(default_factory=dict)
+    # Field read from the text before a pattern on a line without a marker
+    before: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}-v{self.version}"
+
+    @staticmethod
+    def from_dict(entry: dict) -> Template:
+        entry = dict(entry)
+        entry["boxes"] = [ (name, tuple(box)) for name, box in entry.get("boxes", []) ]
+        return Template(**entry)
+
+
+@dataclass
+class FieldValues:
+    """
+    Values of the fields of a document
+    """
+    texts: dict[str, str] = field(default_factory=dict)
+    lists: dict[str, list[str]] = field(default_factory=dict)
+
+    def add(self, name: str, value: str) -> None:
+        if name in self.lists:
+            if len(value) > 0:
+                self.lists[name].append(value)
+        else:
+            self.texts[name] = value
+
+
+class Document:
+    """
+    A PDF being parsed, with its text lines read on first use
+    """
+
+    def __init__(self, pdf: pdfplumber.PDF) -> None:
+        self.pdf = pdf
+        self._lines: list[str] | None = None
+
+    def lines(self) -> list[str]:
+        if self._lines is None:
+            self._lines = []
+            for page in self.pdf.pages:
+                self._lines.extend(page.extract_text_simple().split("\n"))
+        return self._lines
+
+
+class CompiledTemplate:
+    """
+    A template checked and prepared for extracting fields
+    """
+
+    def __init__(self, template: Template) -> None:
+        self.template = template
+        self.name = template.name
+        for name, field_type in template.fields.items():
+            if field_type not in FIELD_TYPES:
+                raise ValueError(f"template {self.name}: field '{name}' has unknown type '{field_type}'")
+        if len(template.markers) != len(template.marker_fields):
+            raise ValueError(f"template {self.name}: {len(template.markers)} markers "
+                             f"but {len(template.marker_fields)} marker fields")
+        used = ([ name for name, _ in template.boxes ] + [ name for name in template.marker_fields if name != "" ] +
+                list(template.exclude) + list(template.before))
+        for name in used:
+            if name not in template.fields:
+                raise ValueError(f"template {self.name}: field '{name}' is not declared")
+
+        self.boxes = [ box for _, box in template.boxes ]
+        self.box_fields = [ name for name, _ in template.boxes ]
+        # Index the boxes by the horizontal bands they cross
+        self.bands: dict[int, list[int]] = {}
+        for index, (_, top, _, bottom) in enumerate(self.boxes):
+            for band in range(int(top // FIELD_BAND_HEIGHT), int(bottom // FIELD_BAND_HEIGHT) + 1):
+                self.bands.setdefault(band, []).append(index)
+        self.exclude = { name: set(values) for name, values in template.exclude.items() }
+        self.before = [ (name, re.compile(pattern)) for name, pattern in template.before.items() ]
+
+    def matches(self, document: Document) -> bool:
+        pages = len(document.pdf.pages)
+        if pages < self.template.min_pages:
+            return False
+        if len(self.boxes) > 0 and pages <= self.template.page:
+            return False
+        for text in self.template.fingerprint:
+            if not any(text in line for line in document.lines()):
+                return False
+        return True
+
+    def extract(self, document: Document) -> FieldValues:
+        values = FieldValues()
+        for name, field_type in self.template.fields.items():
+            if field_type == "list":
+                values.lists[name] = []
+            else:
+                values.texts[name] = ""
+        if len(self.boxes) > 0:
+            page = document.pdf.pages[self.template.page]
+            for name, text in zip(self.box_fields, self.box_texts(page)):
+                self.add(values, name, text.strip())
+        if len(self.template.markers) > 0 or len(self.before) > 0:
+            self.read_lines(document.lines(), values)
+        return values
+
+    def box_texts(self, page: pdfplumber.page.Page) -> list[str]:
+        """
+        Return the text in each box. The same as page.crop(box).extract_text_simple()
+        for each box, but the characters of the page are matched to the boxes in one
+        pass instead of cropping every object on the page once per box.
+        """
+        for box in self.boxes:
+            # Raise the same errors as crop for a box outside the page
+            pdfplumber.page.test_proposed_bbox(box, page.bbox)
+
+        # Clip each character to the boxes it overlaps, keeping the page order
+        box_chars: list[list[dict]] = [ [] for _ in self.boxes ]
+        for char in page.chars:
+            matched: set[int] = set()
+            for band in range(int(char["top"] // FIELD_BAND_HEIGHT), int(char["bottom"] // FIELD_BAND_HEIGHT) + 1):
+                for index in self.bands.get(band, []):
+                    if index in matched:
+                        continue
+                    matched.add(index)
+                    clipped = pdfplumber.utils.clip_obj(char, self.boxes[index])
+                    if clipped is not None:
+                        box_chars[index].append(clipped)
+        return [ pdfplumber.utils.extract_text_simple(chars) for chars in box_chars ]
+
+    def read_lines(self, lines: list[str], values: FieldValues) -> None:
+        """
+        Read the line after each marker, and the text before patterns on other lines
+        """
+        markers = self.template.markers
+        marker = 0
+        marker_found = False
+
+        for line in lines:
+            if marker < len(markers) and markers[marker] == line.strip():
+                marker_found = True
+                marker += 1
+            elif marker_found:
+                marker_found = False
+                name = self.template.marker_fields[marker - 1]
+                value = line.strip()
+                if len(value) > 0 and name != "":
+                    self.add(values, name, value)
+            else:
+                for name, pattern in self.before:
+                    m = pattern.search(line.strip())
+                    if m is not None:
+                        self.add(values, name, line[0 : m.span()[0]])
+
+    def add(self, values: FieldValues, name: str, value: str) -> None:
+        if value not in self.exclude.get(name, set()):
+            values.add(name, value)
+
+
+# Compiled templates of each kind, newest version first
+templates: dict[str, list[CompiledTemplate]] = {}
+
+
+def register(template: Template) -> CompiledTemplate:
+    """
+    Compile a template and add it to the registry, replacing a template of the same kind and version
+    """
+    compiled = CompiledTemplate(template)
+    entries = [ entry for entry in templates.get(template.kind, []) if entry.name != compiled.name ]
+    entries.append(compiled)
+    entries.sort(key=lambda entry: entry.template.version, reverse=True)
+    templates[template.kind] = entries
+    return compiled
+
+
+def load_file(filename: str = TEMPLATE_FILE) -> list[CompiledTemplate]:
+    """
+    Register the templates in a JSON file, if it exists
+    """
+    if not os.path.exists(filename):
+        return []
+    try:
+        with open(filename, "r") as f:
+            entries = json.load(f)
+        return [ register(Template.from_dict(entry)) for entry in entries ]
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Warning: unable to load templates from '{filename}': {e}")
+        return []
+
+
+def select(kind: str, document: Document) -> CompiledTemplate | None:
+    """
+    Return the newest template of the kind matching the document
+    """
+    for template in templates.get(kind, []):
+        if template.matches(document):
+            instrument.count(f"pdf_templates.{template.name}")
+            return template
+    return None
+
+
+def version(kind: str) -> str:
+    """
+    Names of the registered templates of a kind and a digest of their declarations,
+    changes when a template is added or edited
+    """
+    entries = templates.get(kind, [])
+    declarations = json.dumps([ dataclasses.asdict(entry.template) for entry in entries ], sort_keys=True)
+    digest = hashlib.sha256(declarations.encode()).hexdigest()[:16]
+    return ",".join(entry.name for entry in entries) + "/" + digest
+
+
+def test() -> None:
+    """
+    Check template selection, extraction, validation and loading with the test documents
+    """
+    import tempfile
+
+    saved = dict(templates)
+    templates.clear()
+    try:
+        with pdfplumber.open("test/member_waiver.test.pdf") as pdf:
+            document = Document(pdf)
+            boxes: list[tuple[str, Box]] = [ ("name", (66, 162, 240, 166)), ("minors", (57, 419, 180, 425)),
+                                             ("minors", (209, 424, 333, 428)), ("minors", (57, 452, 180, 457)) ]
+            fields = { "name": "text", "minors": "list" }
+            first = register(Template("member", 1, fields, page=1, boxes=boxes))
+            page = pdf.pages[1]
+            assert first.box_texts(page) == [ page.crop(box).extract_text_simple() for _, box in boxes ]
+            values = first.extract(document)
+            assert values.texts == { "name": "Alice Smith" }
+            assert values.lists == { "minors": [ "Carol Smith", "Dan Smith" ] }
+
+            # Newest template with a matching fingerprint is used
+            second = register(Template("member", 2, fields, fingerprint=[ "Member Waiver" ], page=1,
+                                       boxes=boxes[:2], exclude={ "minors": [ "Carol Smith" ] }))
+            register(Template("member", 3, fields, fingerprint=[ "Member Waiver 2099" ]))
+            register(Template("member", 4, fields, min_pages=3))
+            assert select("member", document) is second
+            assert second.extract(document).lists == { "minors": [] }
+            names = "member-v4,member-v3,member-v2,member-v1/"
+            assert version("member").startswith(names)
+            # Editing a template without a new version changes the version of the kind
+            edited = version("member")
+            register(Template("member", 2, fields))
+            assert version("member").startswith(names) and version("member") != edited
+            assert [ entry.template.version for entry in templates["member"] ] == [ 4, 3, 2, 1 ]
+            selected = select("member", document)
+            assert selected is not None and selected.name == "member-v2"
+            assert select("guest", document) is None
+
+        with pdfplumber.open("test/attestation.test.pdf") as pdf:
+            attest = register(Template("attest", 1, { "adults": "list", "date": "text" },
+                                       markers=[ "Proprietary Member Name:", "Adult 2 (if applicable):" ],
+                                       marker_fields=[ "adults", "adults" ], before={ "date": r"\S+@" }))
+            values = attest.extract(Document(pdf))
+            assert values.lists["adults"] == [ "Grace Lee grace@example.com 01/02/1980",
+                                               "Heidi Lee heidi@example.com 03/04/1982" ]
+            assert values.texts["date"] == ""
+
+        for template in [ Template("bad", 1, { "name": "number" }),
+                          Template("bad", 1, { "name": "text" }, boxes=[ ("other", (0, 0, 1, 1)) ]),
+                          Template("bad", 1, { "name": "text" }, markers=[ "Name:" ]) ]:
+            try:
+                register(template)
+                assert False
+            except ValueError:
+                pass
+        assert "bad" not in templates
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "templates.json")
+            with open(filename, "w") as f:
+                json.dump([ { "kind": "guest", "version": 2, "fields": { "adult": "text" },
+                              "markers": [ "Adult Non-Member/Guest:" ], "marker_fields": [ "adult" ] },
+                            { "kind": "member", "version": 5, "fields": { "name": "text" },
+                              "page": 1, "boxes": [ [ "name", [ 66, 162, 240, 166 ] ] ] } ], f)
+            loaded = load_file(filename)
+            assert [ entry.name for entry in loaded ] == [ "guest-v2", "member-v5" ]
+            assert templates["member"][0].boxes == [ (66, 162, 240, 166) ]
+            with open(filename, "w") as f:
+                json.dump([ { "kind": "guest", "version": 3, "fields": { "adult": "date" } } ], f)
+            assert load_file(filename) == []
+            assert load_file(os.path.join(tmpdir, "missing.json")) == []
+    finally:
+        templates.clear()
+        templates.update(saved)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "test":
+        test()
+        sys.exit(0)
+    if len(sys.argv) != 2:
+        print("Usage pdf_templates <template file>")
+        sys.exit(-1)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Error: no file '{sys.argv[1]}'")
+        sys.exit(-1)
+    loaded = load_file(sys.argv[1])
+    for compiled in loaded:
+        print(f"{compiled.name}: {len(compiled.template.fields)} fields, "
+              f"{len(compiled.boxes)} boxes, {len(compiled.template.markers)} markers")
+    sys.exit(0 if len(loaded) > 0 else -1)
@@ -0,0 +1,186 @@
+"""
+Run the stages of a process like a build system.
+
+Each stage lists the files it reads and writes. After a stage runs, the content
+hashes of its inputs and outputs are saved. A later run skips the stage if its
+inputs, parameters and outputs still match the saved hashes; the outputs of
+the earlier run are left in place for the stages that follow.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+from dataclasses import dataclass, field
+from typing import Callable
+
+import csvfile
+import instrument
+
+
+STATE_FILE = "data/pipeline_state.json"
+
+
+@dataclass
+class Stage:
+    """
+    A step of a process and the files it depends on
+    """
+    name: str
+    inputs: list[str]
+    outputs: list[str]
+    run: Callable[[], None]
+    # Values other than file contents the outputs depend on
+    params: dict[str, str] = field(default_factory=dict)
+
+    def file_hashes(self, filenames: list[str]) -> dict[str, str]:
+        return { filename: csvfile.hash_files([filename]) for filename in filenames }
+
+    def record(self) -> dict:
+        return { "inputs": self.file_hashes(self.inputs),
+                 "outputs": self.file_hashes(self.outputs),
+                 "params": self.params }
+
+    def changes(self, saved: dict | None) -> list[str]:
+        """
+        Return reasons the stage needs to run given the record of its last run
+        """
+        if saved is None:
+            return [ "no previous run" ]
+        reasons = []
+        current = self.record()
+        for kind in [ "inputs", "outputs" ]:
+            saved_hashes = saved.get(kind, {})
+            for filename, digest in current[kind].items():
+                if saved_hashes.get(filename) != digest:
+                    reasons.append(f"{kind[:-1]} {filename} changed")
+            for filename in saved_hashes.keys() - current[kind].keys():
+                reasons.append(f"{kind[:-1]} {filename} removed")
+        for name, value in self.params.items():
+            if saved.get("params", {}).get(name) != value:
+                reasons.append(f"{name} is {value}")
+        return reasons
+
+
+class Pipeline:
+    """
+    Run stages in order, skipping stages that are up to date
+    """
+
+    def __init__(self, state_file: str = STATE_FILE, force: bool = False) -> None:
+        self.state_file = state_file
+        self.force = force
+        self.state: dict[str, dict] = self.load_state()
+
+    def load_state(self) -> dict[str, dict]:
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: unable to read '{self.state_file}': {e}")
+            return {}
+
+    def save_state(self) -> None:
+        if not os.path.isdir(os.path.dirname(self.state_file) or "."):
+            return
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def run_stage(self, stage: Stage) -> bool:
+        """
+        Run the stage if it is not up to date. Return True if it ran.
+        """
+        reasons = [ "forced" ] if self.force else stage.changes(self.state.get(stage.name))
+        if len(reasons) == 0:
+            print(f"Note: stage {stage.name} is up to date, skipping")
+            instrument.count("pipeline.stages_skipped")
+            return False
+
+        print(f"Note: run stage {stage.name}: {', '.join(reasons)}")
+        # Forget the last run in case this one fails part way
+        self.state.pop(stage.name, None)
+        self.save_state()
+        with instrument.span(stage.name):
+            stage.run()
+        instrument.count("pipeline.stages_run")
+        # Inputs are hashed after the run, a stage may rewrite its inputs
+        self.state[stage.name] = stage.record()
+        self.save_state()
+        return True
+
+    def run(self, stages: list[Stage]) -> None:
+        for stage in stages:
+            self.run_stage(stage)
+
+
+def test() -> None:
+    """
+    Check which stages run as inputs, outputs and parameters change
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "source.csv")
+        middle = os.path.join(tmpdir, "middle.csv")
+        result = os.path.join(tmpdir, "result.csv")
+        state_file = os.path.join(tmpdir, "state.json")
+        ran: list[str] = []
+
+        def copy(name: str, src: str, dst: str) -> Callable[[], None]:
+            def run() -> None:
+                ran.append(name)
+                with open(src) as f:
+                    text = f.read()
+                with open(dst, "w") as f:
+                    f.write(text.upper() if params["case"] == "upper" else text)
+            return run
+
+        params = { "case": "lower" }
+
+        def run(force: bool = False) -> list[str]:
+            ran.clear()
+            stages = [ Stage("first", [ source ], [ middle ], copy("first", source, middle), dict(params)),
+                       Stage("second", [ middle ], [ result ], copy("second", middle, result)) ]
+            Pipeline(state_file, force).run(stages)
+            return list(ran)
+
+        def write(filename: str, text: str) -> None:
+            with open(filename, "w") as f:
+                f.write(text)
+
+        write(source, "a,b\n")
+        assert run() == [ "first", "second" ]
+        assert run() == []
+        # New input runs the stages after it
+        write(source, "a,c\n")
+        assert run() == [ "first", "second" ]
+        # Same contents written again, nothing to do
+        write(source, "a,c\n")
+        assert run() == []
+        # Changed parameter, the first stage writes new contents
+        params["case"] = "upper"
+        assert run() == [ "first", "second" ]
+        # Output changed or removed outside the pipeline
+        write(result, "x\n")
+        assert run() == [ "second" ]
+        os.remove(middle)
+        assert run() == [ "first" ]
+        assert run(force=True) == [ "first", "second" ]
+
+        # A stage that fails runs again on the next run
+        def fail() -> None:
+            raise RuntimeError("failed")
+        try:
+            Pipeline(state_file, force=True).run([ Stage("first", [ source ], [ middle ], fail, dict(params)) ])
+            assert False
+        except RuntimeError:
+            pass
+        assert run() == [ "first" ]
+
+
+if __name__ == "__main__":
+    test()
@@ -3,9 +3,11 @@ Master control file for member waiver process
 """
 
 import sys
+import datetime
 from googleapiclient.discovery import build  # type: ignore
 
 import gdrive
+import csvfile
 import docs
 import memberdata
 import keys
@@ -13,8 +15,14 @@ import gen_required_waivers
 import waiverrec
 import waiver_calcs
 import report
+import report_engine
+import pipeline
+import instrument
+import profiling
 
 upload: bool = True
+incremental: bool = False
+force: bool = False
 
 def upload_csv_file(drive, local_file_name, remote_folder_name, remote_file_name):
     if not upload:
@@ -46,45 +54,312 @@ def upload_waiver_records():
 
  
 
+def update_required_waivers(membership: memberdata.Membership,
+                            member_keys: keys.MemberKeys,
+                            changes: memberdata.RosterChanges,
+                            required_waivers: waiverrec.RequiredWaivers,
+                            member_waivers: list[docs.MemberWaiver],
+                            attestations: list[docs.Attestation]) -> set[str]:
+    """
+    Update the groups of a previous run for the roster changes and new documents.
+    Return the accounts with records that need a status update.
+    """
+    # Regenerate groups for changed accounts and changed key holders
+    account_nums = changes.affected_accounts()
+    key_holders = member_keys.key_holders()
+    changed_keys = [ member_id for member_id in required_waivers.key_holders.keys() | key_holders.keys()
+                     if required_waivers.key_holders.get(member_id) != key_holders.get(member_id) ]
+    account_nums |= waiver_calcs.member_accounts(membership, changed_keys)
+    account_nums |= required_waivers.group_accounts(changed_keys)
+    print(f"Update required waivers list for {len(account_nums)} accounts")
+    gen_required_waivers.update(membership, member_keys, required_waivers, account_nums)
+
+    # Check documents that are new or signed by members of the changed accounts
+    old_members = changes.removed + [ old for old, _ in changes.changed_members() ]
+    names = waiver_calcs.account_names(membership, required_waivers, account_nums, old_members)
+    waiver_docs, attest_docs = waiver_calcs.select_docs(member_waivers, attestations, names)
+    print(f"Updating waiver status for {len(waiver_docs)} waivers and {len(attest_docs)} attestations")
+    waiver_calcs.review_and_update_waivers(membership, required_waivers, waiver_docs, attest_docs)
+
+    # Records of members matched by the checked documents or matched differently than before
+    doc_members = waiver_calcs.doc_members(membership, member_waivers, attestations)
+    matched = { doc_members[name] for name in waiver_calcs.doc_members(membership, waiver_docs, attest_docs) }
+    for name, member_id in doc_members.items():
+        previous_id = required_waivers.doc_members.get(name)
+        if previous_id != member_id:
+            matched.add(member_id)
+            if previous_id is not None:
+                matched.add(previous_id)
+    # Parents from families.csv are in the family record of another account
+    account_nums |= waiver_calcs.member_accounts(membership, matched)
+    account_nums |= required_waivers.group_accounts(matched)
+
+    required_waivers.key_holders = key_holders
+    required_waivers.doc_members = doc_members
+    return account_nums
+
+
+class WaiverProcess:
+    """
+    Data shared by the stages of the waiver process.
+    Loaded when the first stage that needs it runs.
+    """
+
+    def __init__(self) -> None:
+        self.membership: memberdata.Membership | None = None
+        self.changes: memberdata.RosterChanges | None = None
+        self.member_keys = keys.MemberKeys()
+        self.attestations: list[docs.Attestation] = []
+        self.member_waivers: list[docs.MemberWaiver] = []
+        self.required_waivers: waiverrec.RequiredWaivers | None = None
+
+    def load(self) -> memberdata.Membership:
+        if self.membership is not None:
+            return self.membership
+        membership = memberdata.Membership()
+        if incremental:
+            self.changes = membership.update_csv_files()
+        else:
+            membership.read_csv_files()
+        membership.load_name_cache()
+        self.member_keys.load_keys(membership)
+
+        # Read latest attestations and member waivers
+        self.attestations = docs.Attestation.read_csv()
+        self.member_waivers = docs.MemberWaiver.read_csv()
+        self.membership = membership
+        return membership
+
+    def update_waivers(self) -> None:
+        """
+        Group members by the waivers they need and update the status from the documents
+        """
+        membership = self.load()
+        member_keys = self.member_keys
+        attestations = self.attestations
+        member_waivers = self.member_waivers
+
+        # Families defined in the parents file are not part of the roster changes
+        parents_hash = csvfile.hash_files([memberdata.PARENTS_CSV])
+        required_waivers = None
+        if self.changes is not None:
+            required_waivers = waiverrec.RequiredWaivers.load_state(membership)
+            if required_waivers is not None and required_waivers.parents_hash != parents_hash:
+                print("Note: parents file changed, generate all groups")
+                required_waivers = None
+
+        account_nums: set[str] | None = None
+        if self.changes is not None and required_waivers is not None:
+            account_nums = update_required_waivers(membership, member_keys, self.changes, required_waivers,
+                                                   member_waivers, attestations)
+        else:
+            # Create new groups
+            print("Generate required waivers list")
+            required_waivers = gen_required_waivers.generate(membership, member_keys)
+
+            print("Updating waiver status")
+            # Update status on waiver docs - complete, OK, etc
+            waiver_calcs.review_and_update_waivers(membership, required_waivers, member_waivers, attestations)
+            required_waivers.key_holders = member_keys.key_holders()
+            required_waivers.doc_members = waiver_calcs.doc_members(membership, member_waivers, attestations)
+        docs.MemberWaiver.write_csv(member_waivers)
+        docs.Attestation.write_csv(attestations)
+
+        waiver_calcs.update_waiver_record_status(membership, required_waivers, member_waivers, attestations,
+                                                 account_nums)
+        required_waivers.parents_hash = parents_hash
+        required_waivers.save_state()
+        waiverrec.RequiredWaivers.write_csv_files(required_waivers)
+        waiver_calcs.report_waiver_record_stats(membership, required_waivers, member_keys.member_key_map)
+        self.required_waivers = required_waivers
+
+    def generate_reports(self) -> None:
+        """
+        Generate and save member records
+        """
+        membership = self.load()
+        if self.required_waivers is None:
+            # Use the groups saved by the last run of update_waivers
+            self.required_waivers = waiverrec.RequiredWaivers.load_state(membership)
+            if self.required_waivers is None:
+                self.update_waivers()
+        assert self.required_waivers is not None
+        report_engine.generate_reports(membership, self.attestations, self.required_waivers, self.member_keys)
+
+
+# Files read and written by the stages
+ROSTER_FILES = [ memberdata.ACCOUNTS_CSV, memberdata.MEMBERS_CSV, memberdata.PARENTS_CSV, memberdata.DUES_CSV,
+                 keys.keys_filename ]
+DOC_FILES = [ docs.memberwaiver_csv_filename, docs.attestations_csv_filename ]
+WAIVER_FILES = [ waiverrec.RequiredWaivers.state_filename,
+                 waiverrec.RequiredWaivers.adult_waiver_filename,
+                 waiverrec.RequiredWaivers.familey_waiver_filename,
+                 waiverrec.RequiredWaivers.unknown_waiver_filename ]
+REPORT_FILES = [ report.SINGLE_SIGNER_FAMILY_CSV, report.SINGLE_SIGNER_CSV, report.ATTEST_REQUEST_CSV,
+                 report.ACCOUNT_STATUS_CSV, waiverrec.MemberRecord.member_csv, report.KEY_STATUS_CSV,
+                 keys.updated_keys_filename ]
+UPLOAD_FILES = [ waiverrec.MemberRecord.member_csv, report.ACCOUNT_STATUS_CSV, report.KEY_STATUS_CSV,
+                 memberdata.PARENTS_CSV ]
+
+
 def main():
-    membership = memberdata.Membership()
-    membership.read_csv_files()
-    member_keys = keys.MemberKeys()
-    member_keys.load_keys(membership)
-
-    # Create new groups
-    print("Generate required waivers list")
-    required_waivers = gen_required_waivers.generate(membership, member_keys)
-
-    # Read latest attestations and member waivers
-    attestations = docs.Attestation.read_csv()
-    member_waivers = docs.MemberWaiver.read_csv()
-
-    print("Updating waiver status")
-    # Update status on waiver docs - complete, OK, etc
-    waiver_calcs.review_and_update_waivers(membership, required_waivers, member_waivers, attestations)
-    docs.MemberWaiver.write_csv(member_waivers)
-    docs.Attestation.write_csv(attestations)
-
-    waiver_calcs.update_waiver_record_status(membership, required_waivers, member_waivers, attestations)
-    waiverrec.RequiredWaivers.write_csv_files(required_waivers)
-    waiver_calcs.report_waiver_record_stats(membership, required_waivers, member_keys.member_key_map)
-
-    # Generate and save member records
-    report.generate_single_signer_family_request(membership, required_waivers.with_minor_children)
-    report.generate_single_signer_request(membership, required_waivers.no_minor_children)
-    report.generate_attest_request(membership, attestations, required_waivers.with_minor_children)
-    report.generate_account_status(membership, attestations, required_waivers, member_keys)
-    report.generate_member_records(required_waivers, member_keys)
-    report.generate_key_status(membership, member_keys)
-    report.generate_key_status(membership, member_keys)
-    report.generate_credential_update(membership, member_keys)
-    upload_waiver_records()
+    instrument.reset()
+    process = WaiverProcess()
+    # Member ages are calculated as of today
+    params = { "as_of_date": datetime.date.today().isoformat() }
+    stages = [ pipeline.Stage("waivers", ROSTER_FILES + DOC_FILES, DOC_FILES + WAIVER_FILES,
+                              process.update_waivers, params),
+               pipeline.Stage("reports", ROSTER_FILES + DOC_FILES + WAIVER_FILES, REPORT_FILES,
+                              process.generate_reports, params) ]
+    if upload:
+        stages.append(pipeline.Stage("upload", UPLOAD_FILES, [], upload_waiver_records))
+    with instrument.span("process_waivers"):
+        pipeline.Pipeline(force=force).run(stages)
+
+        if process.membership is not None:
+            process.membership.save_name_cache()
+    instrument.write_trace("process_waivers")
+
+
+
+def test() -> None:
+    """
+    Check that an incremental run after a roster change or a new waiver
+    writes the same records and reports as a full run
+    """
+    import os
+    import shutil
+    import tempfile
+    global upload, incremental, force
+
+    accounts = [ "Acct #,Acct Type,First Name,Last Name,Email,Street Address",
+                 "1,Proprietary Member Annual,Ann,Smith,ann@x.org,1 A St",
+                 "2,Proprietary Member Annual,Bob,Jones,bob@x.org,2 B St",
+                 "3,Proprietary Member Annual,Carol,Lee,carol@x.org,3 C St" ]
+    members = [ "Acct #,Member ID,Member Type,First Name,Last Name,Birthdate,Email",
+                "1,10,Adult,Ann,Smith,1980-01-01,ann@x.org",
+                "1,11,Child,Tim,Smith,2015-01-01,",
+                "2,20,Adult,Bob,Jones,1970-01-01,bob@x.org",
+                "2,21,Child,Sue,Jones,2012-05-05,",
+                "3,30,Adult,Carol,Lee,1990-01-01,carol@x.org" ]
+    # The parent of the family of account 1 is a member of account 3.
+    # Amy is not yet a member.
+    families = [ "Acct #,Parent1,Parent2,Minor1,Minor2,Minor3,Minor4,Minor5",
+                 "1,Carol Lee,,Tim Smith,Amy Smith,,," ]
+    member_keys = [ "FirstName,LastName,UserName,Email,CredentialStatus,ExternalId,ForceUpdate,RemoveUser,"
+                    "CredentialExpirationDateTime,EnableMobileCredential",
+                    "Bob,Jones,2,bob@x.org,Active,K20,,,,",
+                    "Ann,Smith,1,ann@x.org,Deactivated,K10,,,," ]
+    signed = [ ("Bob Jones", ["Sue Jones"]), ("Ann Smith", []) ]
+
+    def write(filename: str, lines: list[str]) -> None:
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def read(filenames: list[str]) -> dict[str, str]:
+        result = {}
+        for filename in filenames:
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    result[filename] = f.read()
+        return result
+
+    def add_waiver(name: str, minors: list[str]) -> None:
+        waivers = docs.MemberWaiver.read_csv()
+        waiver = docs.MemberWaiver()
+        waiver.signatures.append(docs.Signature(name, "2026-05-01"))
+        waiver.minors = minors
+        waiver.file_name = f"{name}.pdf"
+        waiver.web_view_link = f"http://docs/{name}"
+        waivers.append(waiver)
+        docs.MemberWaiver.write_csv(waivers)
+
+    def add_member() -> None:
+        write(memberdata.MEMBERS_CSV, members + [ "1,12,Adult,Dan,Smith,1982-02-02," ])
+
+    def add_minor() -> None:
+        write(memberdata.MEMBERS_CSV, members + [ "1,12,Adult,Dan,Smith,1982-02-02,",
+                                                  "1,13,Child,Amy,Smith,2017-03-03," ])
+
+    def add_parent_waiver() -> None:
+        add_waiver("Carol Lee", ["Tim Smith"])
+
+    # Each change is run incrementally and, applied again to the saved
+    # data, compared with a full run
+    outputs = DOC_FILES + WAIVER_FILES[1:] + REPORT_FILES
+    results: list[tuple[dict[str, str], dict[str, str]]] = []
+    changes = [
+        # A new member in account 1 regenerates its family
+        add_member,
+        # A new waiver of the parent from account 3 reaches the family of account 1
+        add_parent_waiver,
+        # A new minor of the family is missing from the parent's waiver
+        add_minor,
+    ]
+
+    saved = (upload, incremental, force)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            for dirname in ["input", "data", "output"]:
+                os.mkdir(dirname)
+            write(memberdata.ACCOUNTS_CSV, accounts)
+            write(memberdata.MEMBERS_CSV, members)
+            write(memberdata.PARENTS_CSV, families)
+            write(keys.keys_filename, member_keys)
+            docs.MemberWaiver.write_csv([])
+            for name, minors in signed:
+                add_waiver(name, minors)
+
+            upload = False
+            incremental = False
+            force = False
+            main()
+
+            for change in changes:
+                for dirname in ["data", "output"]:
+                    shutil.rmtree(f"before/{dirname}", ignore_errors=True)
+                    shutil.copytree(dirname, f"before/{dirname}")
+                change()
+                incremental = True
+                force = False
+                main()
+                updated = read(outputs)
+
+                for dirname in ["data", "output"]:
+                    shutil.rmtree(dirname)
+                    shutil.copytree(f"before/{dirname}", dirname)
+                change()
+                incremental = False
+                force = True
+                main()
+                results.append((updated, read(outputs)))
+        finally:
+            os.chdir(cwd)
+            upload, incremental, force = saved
 
+    for change, (updated, generated) in zip(changes, results):
+        for filename in outputs:
+            assert updated.get(filename) == generated.get(filename), (change.__name__, filename)
+    _, generated = results[1]
+    assert "http://docs/Carol Lee" in generated[waiverrec.RequiredWaivers.familey_waiver_filename]
+    _, generated = results[2]
+    assert "Carol Lee,,,Tim Smith,,,,,?,N," in generated[docs.memberwaiver_csv_filename]
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        test()
+        sys.exit(0)
+    profile = profiling.requested()
     if "noupload" in sys.argv:
         upload = False
         print("Skip file uploading")
-    main()
+    if "incremental" in sys.argv:
+        incremental = True
+        print("Update previous waiver groupings")
+    if "force" in sys.argv:
+        force = True
+        print("Run all stages")
+    profiling.run("process_waivers", main, profile)
@@ -0,0 +1,120 @@
+"""
+Opt-in profiling of an entry point.
+
+Scripts call requested() before reading their other arguments, then call their
+main() through run(). With --profile on the command line, main() runs under
+cProfile and tracemalloc and these are written next to the outputs:
+
+  output/profile_<name>_<date>_<time>.prof - cProfile stats, for pstats or snakeviz
+  output/profile_<name>_<date>_<time>.txt  - hot functions, peak memory and top allocations
+
+The top allocations are from the checkpoint() with the most memory in use.
+The end of each instrument span is a checkpoint.
+"""
+
+from __future__ import annotations
+
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import datetime
+import tracemalloc
+from typing import Callable, TypeVar
+
+
+PROFILE_FLAG = "--profile"
+PROFILE_DIR = "output"
+# Number of entries in each section of the summary
+TOP_COUNT = 20
+
+R = TypeVar("R")
+
+# Snapshot with the most memory traced: label, size, snapshot
+largest_snapshot: tuple[str, int, tracemalloc.Snapshot] | None = None
+
+
+def requested(argv: list[str] = sys.argv) -> bool:
+    """
+    Return True if profiling was requested, removing the flag from the arguments
+    """
+    if PROFILE_FLAG not in argv:
+        return False
+    argv.remove(PROFILE_FLAG)
+    return True
+
+
+def stats_section(profiler: cProfile.Profile, title: str, sort_key: pstats.SortKey) -> str:
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats(sort_key).print_stats(TOP_COUNT)
+    # Skip the totals printed before the table
+    lines = stream.getvalue().splitlines()
+    start = next((index for index, line in enumerate(lines) if "ncalls" in line), 0)
+    return f"{title}\n" + "\n".join(lines[start:]).rstrip() + "\n"
+
+
+def summary(name: str, seconds: float, profiler: cProfile.Profile, peak: int) -> str:
+    result = f"Profile of {name}: {seconds:.3f}s, peak traced memory {peak / 1024 / 1024:.1f} MiB\n\n"
+    result += stats_section(profiler, "Hot functions by total time (excluding calls)", pstats.SortKey.TIME) + "\n"
+    result += stats_section(profiler, "Hot functions by cumulative time", pstats.SortKey.CUMULATIVE) + "\n"
+    # Functions called far more often than the data size suggest quadratic lookups
+    result += stats_section(profiler, "Most called functions", pstats.SortKey.CALLS) + "\n"
+    if largest_snapshot is None:
+        return result
+    label, size, snapshot = largest_snapshot
+    result += f"Top allocations by line, live at {label} ({size / 1024 / 1024:.1f} MiB traced)\n"
+    for stat in snapshot.statistics("lineno")[:TOP_COUNT]:
+        frame = stat.traceback[0]
+        result += f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n"
+    return result
+
+
+def checkpoint(label: str) -> None:
+    """
+    Take a snapshot of the allocations if they are being traced and more
+    memory is in use than at earlier checkpoints. Call where the data of a run
+    is still loaded, most of it is freed by the time main returns.
+    """
+    global largest_snapshot
+    if not tracemalloc.is_tracing():
+        return
+    size, _ = tracemalloc.get_traced_memory()
+    if largest_snapshot is not None and largest_snapshot[1] >= size:
+        return
+    snapshot = tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, __file__),
+                                                           tracemalloc.Filter(False, tracemalloc.__file__) ])
+    largest_snapshot = (label, size, snapshot)
+
+
+def run(name: str, main: Callable[[], R], enabled: bool = True, profile_dir: str = PROFILE_DIR) -> R:
+    """
+    Call main, profiling it if enabled
+    """
+    if not enabled:
+        return main()
+
+    global largest_snapshot
+    largest_snapshot = None
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return main()
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        checkpoint("end of main")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if os.path.isdir(profile_dir):
+            prefix = os.path.join(profile_dir, f"profile_{name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+            profiler.dump_stats(f"{prefix}.prof")
+            with open(f"{prefix}.txt", "w") as f:
+                f.write(summary(name, seconds, profiler, peak))
+            print(f"Note: write profile {prefix}.prof and {prefix}.txt")
+        else:
+            print(f"Warning: no directory '{profile_dir}' for the profile of {name}")
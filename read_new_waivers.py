@@ -7,21 +7,44 @@ import docs
 import extract_attest
 import extract_members
 import extract_guest
+import instrument
+import download_pdfs
+import profiling
 
 
 upload: bool = True
+# Rebuild the records from all documents, after a parser change
+reparse: bool = False
 
 def main():
+    instrument.reset()
     print("Extract information from new documents.")
     print(f"Reading waiver files for year {docs.YEAR}\n")
-    extract_members.run(upload)
-    extract_attest.run(upload)
-    extract_guest.run(upload)
+    with instrument.span("read_new_waivers"):
+        with instrument.span("member_waivers"):
+            extract_members.run(upload, reparse)
+        with instrument.span("attestations"):
+            extract_attest.run(upload, reparse)
+        with instrument.span("guest_waivers"):
+            extract_guest.run(upload, reparse)
+    instrument.write_trace("read_new_waivers")
 
 if __name__ == "__main__":
+    profile = profiling.requested()
     if "noupload" in sys.argv:
         sys.argv.remove("noupload")
         upload = False
+    if "reparse" in sys.argv:
+        sys.argv.remove("reparse")
+        reparse = True
+    for arg in sys.argv[1:]:
+        # Concurrency of downloading and parsing documents
+        if arg.startswith("downloads="):
+            download_pdfs.download_workers = int(arg[len("downloads="):])
+            sys.argv.remove(arg)
+        elif arg.startswith("parsers="):
+            download_pdfs.parse_workers = int(arg[len("parsers="):])
+            sys.argv.remove(arg)
     if len(sys.argv) > 1:
         docs.YEAR = sys.argv[1]
-    main()
+    profiling.run("read_new_waivers", main, profile)
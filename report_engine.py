@@ -0,0 +1,293 @@
+"""
+Generate the process_waivers reports together.
+
+The data shared by the reports is computed once, then a single pass over the
+active accounts feeds each account and its waiver records to a set of report
+sinks. A second pass over the key entries feeds the key reports. Each sink
+collects its rows in the same order as the individual report functions in
+report.py, so the output files are the same.
+"""
+
+from __future__ import annotations
+
+import time
+
+import docs
+import memberdata
+import waiverrec
+import keys
+import attest_calcs
+import waiver_calcs
+import report
+import instrument
+
+
+class ReportContext:
+    """
+    Data shared by the reports
+    """
+
+    def __init__(self, membership: memberdata.Membership,
+                 attestations: list[docs.Attestation],
+                 waiver_groups: waiverrec.RequiredWaivers,
+                 member_keys: keys.MemberKeys) -> None:
+        self.membership = membership
+        self.waiver_groups = waiver_groups
+        self.member_keys = member_keys
+
+        # Preferred attestation per member
+        self.attest_doc_map = waiver_calcs.create_attest_doc_map(membership, attestations)
+        # Adult and family records per account
+        self.waiver_map = report.account_waiver_map(waiver_groups)
+        # Save attest data for the account status
+        attest_calcs.record_attestations(membership, attestations)
+        membership.set_key_holders(member_keys.key_holders())
+        # Rows of the key file for the credential update, their names resolved in one batch
+        self.key_rows = keys.read_key_file()
+        membership.resolve_names((report.key_row_name(row) for row in self.key_rows), warn=False)
+
+
+class ReportSink:
+    """
+    Collects the rows of one report during the pass over accounts and keys
+    """
+
+    def __init__(self, csv_file: str, header: list[str], backup: bool = True) -> None:
+        self.csv_file = csv_file
+        self.header = header
+        self.backup = backup
+        self.rows: list[dict] = []
+        # Time spent generating the report
+        self.seconds = 0.0
+
+    def add_account(self, context: ReportContext, account: memberdata.AccountEntry) -> None:
+        pass
+
+    def add_adult_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        pass
+
+    def add_family_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        pass
+
+    def add_unknown_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        pass
+
+    def add_key_entry(self, context: ReportContext, key_entry: keys.KeyEntry) -> None:
+        pass
+
+    def add_key_row(self, context: ReportContext, row: dict[str, str]) -> None:
+        pass
+
+    def write(self, context: ReportContext) -> None:
+        report.write_report(self.csv_file, self.header, self.rows, self.backup)
+
+
+class SingleSignerSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(report.SINGLE_SIGNER_CSV, report.SINGLE_SIGNER_HEADER)
+
+    def add_adult_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        row = report.single_signer_row(context.membership, record)
+        if row is not None:
+            self.rows.append(row)
+
+
+class SingleSignerFamilySink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(report.SINGLE_SIGNER_FAMILY_CSV, report.SINGLE_SIGNER_FAMILY_HEADER)
+
+    def add_family_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        self.rows.extend(report.single_signer_family_rows(context.membership, record))
+
+
+class AttestRequestSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(report.ATTEST_REQUEST_CSV, report.ATTEST_REQUEST_HEADER)
+
+    def add_account(self, context: ReportContext, account: memberdata.AccountEntry) -> None:
+        row = report.attest_request_row(context.membership, context.attest_doc_map,
+                                        context.waiver_groups, account)
+        if row is not None:
+            self.rows.append(row)
+
+
+class AccountStatusSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(report.ACCOUNT_STATUS_CSV, report.ACCOUNT_STATUS_HEADER)
+
+    def add_account(self, context: ReportContext, account: memberdata.AccountEntry) -> None:
+        waivers = context.waiver_map.get(account.account_num, [])
+        self.rows.append(report.account_status_row(context.membership, waivers, account))
+
+
+class MemberRecordsSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(waiverrec.MemberRecord.member_csv, waiverrec.MemberRecord.HEADER)
+        # Kept apart so the stable sort sees the same order as MemberRecord.gen_records
+        self.adult_records: list[waiverrec.MemberRecord] = []
+        self.family_records: list[waiverrec.MemberRecord] = []
+        self.unknown_records: list[waiverrec.MemberRecord] = []
+
+    def add_adult_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        self.adult_records.append(waiverrec.MemberRecord.from_adult_record(record, context.member_keys))
+
+    def add_family_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        self.family_records.append(waiverrec.MemberRecord.from_family_record(record, context.member_keys))
+
+    def add_unknown_record(self, context: ReportContext, record: waiverrec.RequiredWaiver) -> None:
+        self.unknown_records.append(waiverrec.MemberRecord.from_unknown_record(record, context.member_keys))
+
+    def write(self, context: ReportContext) -> None:
+        member_records = self.adult_records + self.family_records + self.unknown_records
+        member_records.sort(key=waiverrec.MemberRecord.key_func)
+        print("Note: writing member records CSV")
+        waiverrec.MemberRecord.write_csv(member_records, self.csv_file)
+
+
+class KeyStatusSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(report.KEY_STATUS_CSV, report.KEY_STATUS_HEADER, backup=False)
+
+    def add_key_entry(self, context: ReportContext, key_entry: keys.KeyEntry) -> None:
+        row = report.key_status_row(context.membership, key_entry)
+        if row is not None:
+            self.rows.append(row)
+
+
+class CredentialUpdateSink(ReportSink):
+    def __init__(self) -> None:
+        super().__init__(keys.updated_keys_filename, [])
+
+    def add_key_row(self, context: ReportContext, row: dict[str, str]) -> None:
+        report.update_credential_row(context.membership, row)
+        self.rows.append(row)
+
+    def write(self, context: ReportContext) -> None:
+        keys.write_key_file(self.csv_file, self.rows)
+
+
+def default_sinks() -> list[ReportSink]:
+    return [ SingleSignerFamilySink(),
+             SingleSignerSink(),
+             AttestRequestSink(),
+             AccountStatusSink(),
+             MemberRecordsSink(),
+             KeyStatusSink(),
+             CredentialUpdateSink() ]
+
+
+def group_records(records: list[waiverrec.RequiredWaiver],
+                  account_rank: dict[str, int]) -> dict[str, list[waiverrec.RequiredWaiver]] | None:
+    """
+    Group records by the account they were generated for.
+    Return None if the records are not in account order, and so can not be
+    fed to the reports account by account without changing the row order.
+    Records of other accounts are grouped under "" and must come last.
+    """
+    groups: dict[str, list[waiverrec.RequiredWaiver]] = {}
+    last_rank = -1
+    for record in records:
+        account_num = record.group_account_num
+        rank = account_rank.get(account_num, len(account_rank))
+        if rank < last_rank:
+            return None
+        last_rank = rank
+        if rank == len(account_rank):
+            account_num = ""
+        groups.setdefault(account_num, []).append(record)
+    return groups
+
+
+class ReportWalk:
+    """
+    The order the accounts, records and keys are fed to the report sinks.
+    Not changed while the reports are generated, so sinks can be fed in parallel.
+    """
+
+    def __init__(self, context: ReportContext) -> None:
+        waiver_groups = context.waiver_groups
+        self.accounts = context.membership.active_member_accounts()
+        account_rank = { account.account_num: rank for rank, account in enumerate(self.accounts) }
+        adult_groups = group_records(waiver_groups.no_minor_children, account_rank)
+        family_groups = group_records(waiver_groups.with_minor_children, account_rank)
+        unknown_groups = group_records(waiver_groups.unknown_status, account_rank)
+        self.in_order = adult_groups is not None and family_groups is not None and unknown_groups is not None
+        if adult_groups is None or family_groups is None or unknown_groups is None:
+            print("Note: waiver records not in account order")
+            adult_groups, family_groups, unknown_groups = {}, {}, {}
+        self.adult_groups = adult_groups
+        self.family_groups = family_groups
+        self.unknown_groups = unknown_groups
+
+    def feed_account(self, context: ReportContext, sink: ReportSink,
+                     account: memberdata.AccountEntry) -> None:
+        sink.add_account(context, account)
+        feed_records(context, sink,
+                     self.adult_groups.get(account.account_num, []),
+                     self.family_groups.get(account.account_num, []),
+                     self.unknown_groups.get(account.account_num, []))
+
+    def feed_remaining(self, context: ReportContext, sink: ReportSink) -> None:
+        """
+        Feed the records not fed with their account, then the keys
+        """
+        if self.in_order:
+            # Records generated for accounts that are no longer active
+            feed_records(context, sink, self.adult_groups.get("", []),
+                         self.family_groups.get("", []), self.unknown_groups.get("", []))
+        else:
+            # Feed the records in list order after the accounts
+            feed_records(context, sink, context.waiver_groups.no_minor_children,
+                         context.waiver_groups.with_minor_children, context.waiver_groups.unknown_status)
+
+        for key_entry in context.member_keys.key_entries():
+            sink.add_key_entry(context, key_entry)
+        for row in context.key_rows:
+            sink.add_key_row(context, row)
+
+
+def feed_records(context: ReportContext, sink: ReportSink,
+                 adult_records: list[waiverrec.RequiredWaiver],
+                 family_records: list[waiverrec.RequiredWaiver],
+                 unknown_records: list[waiverrec.RequiredWaiver]) -> None:
+    for record in adult_records:
+        sink.add_adult_record(context, record)
+    for record in family_records:
+        sink.add_family_record(context, record)
+    for record in unknown_records:
+        sink.add_unknown_record(context, record)
+
+
+def generate_reports(membership: memberdata.Membership,
+                     attestations: list[docs.Attestation],
+                     waiver_groups: waiverrec.RequiredWaivers,
+                     member_keys: keys.MemberKeys,
+                     sinks: list[ReportSink] | None = None) -> dict[str, float]:
+    """
+    Generate the reports for the active accounts, waiver records and keys.
+    All reports are fed in a single pass over the accounts.
+    Return the seconds spent on each report.
+    """
+    if sinks is None:
+        sinks = default_sinks()
+    context = ReportContext(membership, attestations, waiver_groups, member_keys)
+    walk = ReportWalk(context)
+
+    # One pass over the accounts and their records
+    for account in walk.accounts:
+        for sink in sinks:
+            start = time.perf_counter()
+            walk.feed_account(context, sink, account)
+            sink.seconds += time.perf_counter() - start
+    for sink in sinks:
+        start = time.perf_counter()
+        walk.feed_remaining(context, sink)
+        sink.write(context)
+        sink.seconds += time.perf_counter() - start
+
+    timings = {}
+    for sink in sinks:
+        print(f"Note: report {sink.csv_file} took {sink.seconds:.3f}s")
+        instrument.add_time(f"report_engine.{sink.csv_file}", sink.seconds)
+        timings[sink.csv_file] = sink.seconds
+    return timings
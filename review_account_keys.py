@@ -9,134 +9,141 @@ from dataclasses import dataclass
 import csv
 import memberdata
 import keys
+import profiling
 
 
 # File to generate
 output_filename = "output/account_keys.csv"
 
 
-# Read membership data
-membership = memberdata.Membership()
-membership.read_csv_files()
-
 @dataclass
 class AccountEntry:
     account_num: str
     key_count: int  = 0
     enabled_key_count: int = 0
 
-# Map { account_num, AccountEntry }
-account_key_count: dict[str, AccountEntry] = {}
+def main():
+    # Read membership data
+    membership = memberdata.Membership()
+    membership.read_csv_files()
 
-# Read mobile key information
-# Iterate over keys, counting keys
-for key_entry in keys.read_key_entries():
+    # Map { account_num, AccountEntry }
+    account_key_count: dict[str, AccountEntry] = {}
 
-    # TODO: consider how staff is modeled in membership database
-    if key_entry.account_num.lower().startswith("staff"):
-        continue
+    # Read mobile key information
+    # Iterate over keys, counting keys
+    for key_entry in keys.read_key_entries():
 
-    if key_entry.account_num not in membership.account_nums():
-        print(
-            f"Error: Key with invalid account num '{key_entry.account_num}' for {key_entry.member_name}"
-        )
-        continue
-    else:
-        account = membership.get_account(key_entry.account_num)
-        if not account.is_active_member() and not account.is_staff():
+        # TODO: consider how staff is modeled in membership database
+        if key_entry.account_num.lower().startswith("staff"):
+            continue
+
+        if key_entry.account_num not in membership.account_map:
             print(
-                f"Error: key held by non-active account {key_entry.member_name} acct# {key_entry.account_num}"
+                f"Error: Key with invalid account num '{key_entry.account_num}' for {key_entry.member_name}"
             )
-
-    valid = False
-    member_entries = membership.find_members_by_name(key_entry.member_name)
-    if len(member_entries) < 1:
-        print(
-            f"Error: Key with invalid member name {key_entry.member_name} acct# {key_entry.account_num}"
-        )
-    else:
-        for member_entry in member_entries:
-            # Find a matching member entry with the same account number
-            valid = valid or member_entry.account_num == key_entry.account_num
-        if not valid:
+            continue
+        else:
+            account = membership.get_account(key_entry.account_num)
+            if not account.is_active_member() and not account.is_staff():
+                print(
+                    f"Error: key held by non-active account {key_entry.member_name} acct# {key_entry.account_num}"
+                )
+
+        valid = False
+        member_entries = membership.find_members_by_name(key_entry.member_name)
+        if len(member_entries) < 1:
             print(
-                f"Error: Key account '{key_entry.account_num}' does not match name {key_entry.member_name}"
+                f"Error: Key with invalid member name {key_entry.member_name} acct# {key_entry.account_num}"
             )
+        else:
+            for member_entry in member_entries:
+                # Find a matching member entry with the same account number
+                valid = valid or member_entry.account_num == key_entry.account_num
+            if not valid:
+                print(
+                    f"Error: Key account '{key_entry.account_num}' does not match name {key_entry.member_name}"
+                )
+
+        entry: AccountEntry | None = account_key_count.get(key_entry.account_num)
+        if entry is None:
+            entry = AccountEntry(key_entry.account_num)
+            account_key_count[key_entry.account_num] = entry
+        entry.key_count += 1
+        if key_entry.enabled:
+            entry.enabled_key_count += 1
+
+
+    # Open output file
+    print()
+    print(f"Creating output file: {output_filename}")
+    output_file = open(output_filename, "w", newline="")
+    output_csv = csv.writer(output_file)
+    output_csv.writerow(["AccountNum", "first_name", "last_name", "email", "key_count"])
+
+    account_with_keys_count = 0
+    account_with_enabled_keys_count = 0
+    account_without_keys_count = 0
+    max_account_keys = 0
+    total_keys = 0
+    enabled_keys = 0
+
+    for account in membership.accounts():
+        entry = account_key_count.get(account.account_num)
+        if entry is None:
+            entry = AccountEntry(account.account_num)
+        if account.is_staff():
+            # Skip staff accounts
+            continue
+
+        if not account.is_proprietary_member():
+            # Skip non -proprietary member accounts, but check if there is a key
+            if entry.key_count > 0:
+                print(
+                    f"Note: non-proprietary account with keys '{account.account_num}' {account.billing_name}"
+                )
+            continue
+
+        total_keys += entry.key_count
+        enabled_keys += entry.enabled_key_count
+
 
-    entry: AccountEntry | None = account_key_count.get(key_entry.account_num)
-    if entry is None:
-        entry = AccountEntry(key_entry.account_num)
-        account_key_count[key_entry.account_num] = entry
-    entry.key_count += 1
-    if key_entry.enabled:
-        entry.enabled_key_count += 1
-
-
-# Open output file
-print()
-print(f"Creating output file: {output_filename}")
-output_file = open(output_filename, "w", newline="")
-output_csv = csv.writer(output_file)
-output_csv.writerow(["AccountNum", "first_name", "last_name", "email", "key_count"])
-
-account_with_keys_count = 0
-account_with_enabled_keys_count = 0
-account_without_keys_count = 0
-max_account_keys = 0
-total_keys = 0
-enabled_keys = 0
-
-for account in membership.accounts():
-    entry = account_key_count.get(account.account_num)
-    if entry is None:
-        entry = AccountEntry(account.account_num)
-    if account.is_staff():
-        # Skip staff accounts
-        continue
-
-    if not account.is_proprietary_member():
-        # Skip non -proprietary member accounts, but check if there is a key
         if entry.key_count > 0:
-            print(
-                f"Note: non-proprietary account with keys '{account.account_num}' {account.billing_name}"
-            )
-        continue
-
-    total_keys += entry.key_count
-    enabled_keys += entry.enabled_key_count
-    
-
-    if entry.key_count > 0:
-        account_with_keys_count += 1
-        if entry.enabled_key_count > 0:
-            account_with_enabled_keys_count += 1
-    else:
-        account_without_keys_count += 1
-
-    if entry.key_count > max_account_keys:
-        max_account_keys = entry.key_count
-
-    output_csv.writerow(
-        [
-            account.account_num,
-            account.billing_name.first_name,
-            account.billing_name.last_name,
-            account.email,
-            entry.key_count,
-            entry.enabled_key_count
-        ]
-    )
-
-
-output_file.close()
-
-print(f"Total keys: {total_keys}")
-print(f"Total enabled keys: {enabled_keys}")
-print(f"Accounts with keys: {account_with_keys_count}")
-print(f"Accounts with enabled keys: {account_with_enabled_keys_count}")
-print(f"Accounts without keys: {account_without_keys_count}")
-print(f"Max keys for an account: {max_account_keys}")
-if account_with_keys_count > 0:
-    print(
-        f"Avg. number of keys for accounts with keys {total_keys / account_with_keys_count}"
-    )
+            account_with_keys_count += 1
+            if entry.enabled_key_count > 0:
+                account_with_enabled_keys_count += 1
+        else:
+            account_without_keys_count += 1
+
+        if entry.key_count > max_account_keys:
+            max_account_keys = entry.key_count
+
+        output_csv.writerow(
+            [
+                account.account_num,
+                account.billing_name.first_name,
+                account.billing_name.last_name,
+                account.email,
+                entry.key_count,
+                entry.enabled_key_count
+            ]
+        )
+
+
+    output_file.close()
+
+    print(f"Total keys: {total_keys}")
+    print(f"Total enabled keys: {enabled_keys}")
+    print(f"Accounts with keys: {account_with_keys_count}")
+    print(f"Accounts with enabled keys: {account_with_enabled_keys_count}")
+    print(f"Accounts without keys: {account_without_keys_count}")
+    print(f"Max keys for an account: {max_account_keys}")
+    if account_with_keys_count > 0:
+        print(
+            f"Avg. number of keys for accounts with keys {total_keys / account_with_keys_count}"
+        )
+    profiling.checkpoint("end of review_account_keys")
+
+
+if __name__ == "__main__":
+    profiling.run("review_account_keys", main, profiling.requested())
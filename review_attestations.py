@@ -5,6 +5,7 @@ import docs
 import memberdata
 import keys
 import attest_calcs
+import profiling
 
 
 reported: dict[str, bool] = {}
@@ -43,22 +44,22 @@ def review_account(
     known_members = membership.get_members_for_account_num(account.account_num)
     attested_members = set()
 
+    matches = membership.resolve_names((entry.name for entry in account_attest.people), warn=False)
     for attest_entry in account_attest.people:
-        name = memberdata.MemberName.CreateMemberName(attest_entry.name)
-        if name is None:
+        match = matches[attest_entry.name]
+        if not match.is_parsed():
             report_once(account)
             print(f"\tError: unable to parse name {attest_entry.name}")
             reported = True
             continue
 
-        members = membership.find_members_by_name(name)
-        if len(members) == 0:
+        if match.member is None:
             report_once(account)
             print(f"\tError: unable to find name {attest_entry.name}")
             reported = True
             continue
 
-        attested_members.add(members[0])
+        attested_members.add(match.member)
 
     # Check all members are attested
     for member in known_members:
@@ -106,7 +107,8 @@ def main():
 
     for account in membership.accounts():
         review_account(membership, member_keys, account)
+    profiling.checkpoint("end of review_attestations")
 
 
 if __name__ == "__main__":
-    main()
+    profiling.run("review_attestations", main, profiling.requested())
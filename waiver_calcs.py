@@ -10,6 +10,7 @@ Todo: Generate list of members that are covered by a signed waiver
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import Iterable
 import csv
 
 import docs
@@ -18,6 +19,7 @@ import memberdata
 import waiverrec
 import keys
 import attest_calcs
+import instrument
 
 
 def check_waiver(membership: memberdata.Membership, 
@@ -111,6 +113,7 @@ def review_member_attest_docs(membership: memberdata.Membership, attest_docs: li
                 print(f"Warning: No member found for attest signature {adult.name} in {attest_doc.web_view_link}")
 
 
+@instrument.timed("waiver_calcs.review_and_update_waivers")
 def review_and_update_waivers(membership: memberdata.Membership,
                               waiver_groups: waiverrec.RequiredWaivers,
                               waiver_docs: list[docs.MemberWaiver],
@@ -119,25 +122,31 @@ def review_and_update_waivers(membership: memberdata.Membership,
     Review all of the attestation and waiver documents - check for inconsistencies / errors.
     Update minor complete status reflecting if all minors are covered
     """
+    instrument.count("waiver_calcs.waivers_reviewed", len(waiver_docs))
+    instrument.count("waiver_calcs.attestations_reviewed", len(attest_docs))
     review_member_waiver_docs(membership, waiver_docs)
     review_member_attest_docs(membership, attest_docs)
     update_waivers_complete(membership, waiver_groups, waiver_docs, attest_docs)
 
 
+@instrument.timed("waiver_calcs.create_waiver_doc_map")
 def create_waiver_doc_map(membership: memberdata.Membership, member_waivers: list[docs.MemberWaiver]) -> dict[str,docs.MemberWaiver]:
     """
     Create a dictionary of preferred waiver docs for each person mapped by ID.
     We find the best waiver associated with a person.
     """
     doc_map: dict[str, docs.MemberWaiver] = {}
+    matches = membership.resolve_names(signature.name
+                                       for waiver_doc in member_waivers
+                                       for signature in waiver_doc.signatures)
     for waiver_doc in member_waivers:
         for signature in waiver_doc.signatures:
-            member_name = memberdata.MemberName.CreateMemberName(signature.name)
-            if member_name is None:
+            match = matches[signature.name]
+            if not match.is_parsed():
                 if not waiver_doc.reviewed:
                     print(f"Warning: unable to parse waiver signature {signature.name} in {waiver_doc.web_view_link}")
                 continue
-            member = membership.find_one_member_by_name(member_name)
+            member = match.member
             if member is None:
                 if not waiver_doc.reviewed:
                     print(f"Warning: unable to find member for waiver signature {signature.name} in {waiver_doc.web_view_link}")
@@ -160,21 +169,23 @@ def create_waiver_doc_map(membership: memberdata.Membership, member_waivers: lis
 
     return doc_map
 
+@instrument.timed("waiver_calcs.create_attest_doc_map")
 def create_attest_doc_map(membership: memberdata.Membership, attestations: list[docs.Attestation]) -> dict[str, docs.Attestation]:
     """
     Create a dictionary of preffered attest docs for each person by member_id
     """
     doc_map: dict[str, docs.Attestation] = {}
+    matches = membership.resolve_names(attestation.adult().name for attestation in attestations)
     for attestation in attestations:
         # Use lower case name
         name = attestation.adult().name
 
-        member_name = memberdata.MemberName.CreateMemberName(name)
-        if member_name is None:
+        match = matches[name]
+        if not match.is_parsed():
             if not attestation.reviewed:
                 print(f"Warning: unable to parse attest signature {name} in {attestation.web_view_link}")
             continue
-        member = membership.find_one_member_by_name(member_name)
+        member = match.member
         if member is None:
             if not attestation.reviewed:
                 print(f"Warning: unable to find member for attest signature {name} in {attestation.web_view_link}")
@@ -193,14 +204,70 @@ def create_attest_doc_map(membership: memberdata.Membership, attestations: list[
 
     return doc_map
 
+def doc_members(membership: memberdata.Membership,
+                member_waivers: list[docs.MemberWaiver],
+                attestations: list[docs.Attestation]) -> dict[str, str]:
+    """
+    Map the signature names of the documents to the member_id of the matched member, "" if none.
+    """
+    names = [ signature.name for waiver_doc in member_waivers for signature in waiver_doc.signatures ]
+    names.extend(attestation.adult().name for attestation in attestations if len(attestation.adults) > 0)
+    matches = membership.resolve_names(names, warn=False)
+    return { name: match.member.member_id if match.member is not None else ""
+             for name, match in matches.items() }
+
+
+def member_accounts(membership: memberdata.Membership, member_ids: Iterable[str]) -> set[str]:
+    """
+    Accounts of the members that are still in the membership
+    """
+    return { member.account_num for member in membership.get_members_by_ids(member_ids)
+             if member is not None }
+
+
+def account_names(membership: memberdata.Membership, waiver_groups: waiverrec.RequiredWaivers,
+                  account_nums: set[str], members: Iterable[memberdata.MemberEntry]) -> set[str]:
+    """
+    Lower case names of the members of the accounts, the members of their
+    records, including parents from other accounts, and the given members
+    """
+    names: set[str] = set()
+    for account_num in account_nums:
+        for member in membership.get_members_for_account_num(account_num):
+            names.update(name.lower() for name in member.name.allnames())
+    for member in waiver_groups.group_members(account_nums):
+        names.update(name.lower() for name in member.name.allnames())
+    for member in members:
+        names.update(name.lower() for name in member.name.allnames())
+    return names
+
+
+def select_docs(member_waivers: list[docs.MemberWaiver],
+                attestations: list[docs.Attestation],
+                names: set[str]) -> tuple[list[docs.MemberWaiver], list[docs.Attestation]]:
+    """
+    Select documents not yet checked and documents signed by one of the names
+    """
+    waiver_docs = [ waiver_doc for waiver_doc in member_waivers
+                    if waiver_doc.complete == "?" or
+                    any(signature.name.lower() in names for signature in waiver_doc.signatures) ]
+    attest_docs = [ attestation for attestation in attestations
+                    if attestation.complete == "?" or
+                    (len(attestation.adults) > 0 and attestation.adult().name.lower() in names) ]
+    return waiver_docs, attest_docs
+
+
+@instrument.timed("waiver_calcs.update_waiver_record_status")
 def update_waiver_record_status(membership: memberdata.Membership,
                                 waiver_groups: waiverrec.RequiredWaivers,
                                 member_waivers: list[docs.MemberWaiver],
-                                attestations: list[docs.Attestation]) -> None:
+                                attestations: list[docs.Attestation],
+                                account_nums: set[str] | None = None) -> None:
     """
     Determine and update the status for each desired waiver.
     Use the member waivers and attestations to update the status of each
     desired waiver.
+    If account_nums is given, only the records of those accounts are updated.
     """
     print("Note: updating waiver records status")
 
@@ -211,6 +278,9 @@ def update_waiver_record_status(membership: memberdata.Membership,
 
     # Update the signed state of waviers 
     for adult_record in waiver_groups.no_minor_children:
+        if account_nums is not None and adult_record.group_account_num not in account_nums:
+            continue
+        instrument.count("waiver_calcs.adult_records_updated")
         adult_record.signed = False
 
         waiver_doc = waiver_doc_map.get(adult_record.adult().member_id)
@@ -228,6 +298,10 @@ def update_waiver_record_status(membership: memberdata.Membership,
 
     # Update signed state of family waivers
     for family_record in waiver_groups.with_minor_children:
+        # Parents from families.csv may be members of another account than the family
+        if account_nums is not None and family_record.group_account_num not in account_nums:
+            continue
+        instrument.count("waiver_calcs.family_records_updated")
         all_signed: bool = True
 
         for index, adult in enumerate(family_record.adults):
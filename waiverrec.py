@@ -6,7 +6,9 @@ Model member waiver records
 from __future__ import annotations
 
 import csv
+import json
 import os
+from typing import Iterable
 
 import csvfile
 import memberdata
@@ -27,8 +29,11 @@ class RequiredWaiver:
         self.signed: bool = False
         self.has_key: bool = False
         self.key_enabled: bool = False
+        # Account the record was generated for, parents in families.csv may be from another account
+        self.group_account_num: str = ""
         if member is not None:
             self.adults.append(member)
+            self.group_account_num = member.account_num
 
     FIELD_HAS_KEY = "has_key"
     FIELD_KEY_ENABLED = "key_enabled"
@@ -109,6 +114,7 @@ class RequiredWaiver:
 
 
         record = RequiredWaiver()
+        record.group_account_num = row[csvfile.ACCOUNT_NUM]
         record.signed = csvfile.is_signed(row[csvfile.SIGNED])
         record.has_key = csvfile.is_true_value(row[RequiredWaiver.FIELD_HAS_KEY])
         record.key_enabled = csvfile.is_true_value(row[RequiredWaiver.FIELD_KEY_ENABLED])
@@ -193,18 +199,163 @@ class RequiredWaivers:
         self.unknown_parents_count = 0
         self.known_parents_count = 0
 
-    def find_adult_record(self, name: str) -> RequiredWaiver|None:
+        # Inputs the records were computed from, saved with the state
+        # Key holders: member_id -> key enabled
+        self.key_holders: dict[str, bool] = {}
+        # Signature names of documents -> member_id of the matched member, "" if none
+        self.doc_members: dict[str, str] = {}
+        # Hash of the parents file the families were generated from
+        self.parents_hash: str = ""
+
+        # Lookup indexes over the record lists, the first record found wins
+        # except for family_by_adult_id, see index_family_record()
+        self.family_by_name: dict[str, RequiredWaiver] = {}   # lower case adult name
+        self.adult_by_name: dict[str, RequiredWaiver] = {}    # adult name
+        self.adult_by_id: dict[str, RequiredWaiver] = {}      # adult member_id
+        self.family_by_adult_id: dict[str, RequiredWaiver] = {}  # family adult member_id
+        self.family_by_minor_id: dict[str, RequiredWaiver] = {}  # family minor member_id
+        # Record lists and lengths when indexed, to notice lists changed directly
+        self.indexed_lists: tuple = ()
+
+    def merge(self, updates: dict[str, RequiredWaivers], account_order: list[str]) -> None:
+        """
+        Replace the records of each account in updates with the updated records.
+        Records are ordered by account_order, records of other accounts follow.
+        """
+        self.no_minor_children = RequiredWaivers.merge_records(
+            self.no_minor_children,
+            { account_num: groups.no_minor_children for account_num, groups in updates.items() },
+            account_order)
+        self.with_minor_children = RequiredWaivers.merge_records(
+            self.with_minor_children,
+            { account_num: groups.with_minor_children for account_num, groups in updates.items() },
+            account_order)
+        self.unknown_status = RequiredWaivers.merge_records(
+            self.unknown_status,
+            { account_num: groups.unknown_status for account_num, groups in updates.items() },
+            account_order)
+        self.index_records()
+
+    @staticmethod
+    def merge_records(records: list[RequiredWaiver], updates: dict[str, list[RequiredWaiver]],
+                      account_order: list[str]) -> list[RequiredWaiver]:
+        by_account: dict[str, list[RequiredWaiver]] = {}
+        for record in records:
+            account_num = record.group_account_num
+            if account_num not in updates:
+                by_account.setdefault(account_num, []).append(record)
+        for account_num, updated in updates.items():
+            by_account.setdefault(account_num, []).extend(updated)
+
+        result: list[RequiredWaiver] = []
+        for account_num in account_order:
+            result.extend(by_account.pop(account_num, []))
+        for remaining in by_account.values():
+            result.extend(remaining)
+        return result
+
+    def add_adult_record(self, record: RequiredWaiver) -> None:
+        self.check_index()
+        self.no_minor_children.append(record)
+        self.index_adult_record(record)
+        self.indexed_lists = self.list_state()
+
+    def add_family_record(self, record: RequiredWaiver) -> None:
+        self.check_index()
+        self.with_minor_children.append(record)
+        self.index_family_record(record)
+        self.indexed_lists = self.list_state()
+
+    def add_unknown_record(self, record: RequiredWaiver) -> None:
+        self.unknown_status.append(record)
+
+    def list_state(self) -> tuple:
+        return (self.no_minor_children, len(self.no_minor_children),
+                self.with_minor_children, len(self.with_minor_children))
+
+    def index_adult_record(self, record: RequiredWaiver) -> None:
+        self.adult_by_name.setdefault(record.adult().name.fullname(), record)
+        self.adult_by_id.setdefault(record.adult().member_id, record)
+
+    def index_family_record(self, record: RequiredWaiver) -> None:
+        for adult in record.adults:
+            self.family_by_name.setdefault(adult.name.fullname().lower(), record)
+            # The last family of an adult wins, as the attest request has always used
+            self.family_by_adult_id[adult.member_id] = record
+        for minor in record.minors:
+            self.family_by_minor_id.setdefault(minor.member_id, record)
+
+    def index_records(self) -> None:
+        """
+        Rebuild the lookup indexes from the record lists
+        """
+        self.adult_by_name = {}
+        self.adult_by_id = {}
+        self.family_by_name = {}
+        self.family_by_adult_id = {}
+        self.family_by_minor_id = {}
         for record in self.no_minor_children:
-            if record.adult().name.fullname() == name:
-                return record
-        return None
-    
-    def find_family_record(self, name: str) -> RequiredWaiver|None:
+            self.index_adult_record(record)
         for record in self.with_minor_children:
-            for adult in record.adults:
-                if adult.name.fullname().lower() == name.lower():
-                    return record
-        return None
+            self.index_family_record(record)
+        self.indexed_lists = self.list_state()
+
+    def check_index(self) -> None:
+        """
+        Rebuild the indexes if a record list was replaced or changed in length
+        """
+        state = self.list_state()
+        if (len(self.indexed_lists) != len(state)
+                or any(a is not b for a, b in zip(self.indexed_lists[0::2], state[0::2]))
+                or self.indexed_lists[1::2] != state[1::2]):
+            self.index_records()
+
+    def find_adult_record(self, name: str) -> RequiredWaiver|None:
+        self.check_index()
+        return self.adult_by_name.get(name)
+
+    def find_adult_record_by_id(self, member_id: str) -> RequiredWaiver|None:
+        self.check_index()
+        return self.adult_by_id.get(member_id)
+
+    def find_family_record(self, name: str) -> RequiredWaiver|None:
+        self.check_index()
+        return self.family_by_name.get(name.lower())
+
+    def find_family_record_by_adult_id(self, member_id: str) -> RequiredWaiver|None:
+        """
+        Last family record with the member as one of the adults
+        """
+        self.check_index()
+        return self.family_by_adult_id.get(member_id)
+
+    def find_family_record_by_minor_id(self, member_id: str) -> RequiredWaiver|None:
+        """
+        Family record that includes the minor
+        """
+        self.check_index()
+        return self.family_by_minor_id.get(member_id)
+
+    def group_accounts(self, member_ids: Iterable[str]) -> set[str]:
+        """
+        Group accounts of the adult and family records that include one of the members.
+        A parent from families.csv may be in the family record of another account,
+        and in more than one family record.
+        """
+        member_ids = set(member_ids)
+        result: set[str] = set()
+        for record in self.no_minor_children + self.with_minor_children:
+            if any(member.member_id in member_ids for member in record.adults + record.minors):
+                result.add(record.group_account_num)
+        return result
+
+    def group_members(self, account_nums: set[str]) -> list[MemberEntry]:
+        """
+        Adults and minors of the adult and family records of the accounts
+        """
+        return [ member for record in self.no_minor_children + self.with_minor_children
+                 if record.group_account_num in account_nums
+                 for member in record.adults + record.minors ]
 
     adult_waiver_filename = "output/adult_records.csv"
     familey_waiver_filename = "output/family_records.csv"
@@ -216,12 +367,92 @@ class RequiredWaivers:
         groupings.no_minor_children = RequiredWaiver.read_csv(membership, RequiredWaivers.adult_waiver_filename)
         groupings.with_minor_children = RequiredWaiver.read_csv(membership, RequiredWaivers.familey_waiver_filename)
         groupings.unknown_status = RequiredWaiver.read_csv(membership, RequiredWaivers.unknown_waiver_filename)
+        groupings.index_records()
         return groupings
 
     def write_csv_files(self) -> None:
         RequiredWaiver.write_csv(self.no_minor_children, RequiredWaivers.adult_waiver_filename)
         RequiredWaiver.write_csv(self.with_minor_children, RequiredWaivers.familey_waiver_filename)
         RequiredWaiver.write_csv(self.unknown_status, RequiredWaivers.unknown_waiver_filename)
+
+    state_filename = "data/required_waivers.json"
+
+    @staticmethod
+    def record_state(record: RequiredWaiver) -> dict:
+        return { "account": record.group_account_num,
+                 "adults": [ adult.member_id for adult in record.adults ],
+                 "minors": [ minor.member_id for minor in record.minors ],
+                 "signed": record.signed,
+                 "signatures": record.signatures,
+                 "web_links": record.web_links,
+                 "has_key": record.has_key,
+                 "key_enabled": record.key_enabled }
+
+    @staticmethod
+    def read_record_state(membership: memberdata.Membership, state: dict) -> RequiredWaiver | None:
+        """
+        Return None if a member of the record is no longer in the membership
+        """
+        record = RequiredWaiver()
+        adults = membership.get_members_by_ids(state["adults"])
+        minors = membership.get_members_by_ids(state["minors"])
+        record.adults = [ member for member in adults if member is not None ]
+        record.minors = [ member for member in minors if member is not None ]
+        if len(record.adults) != len(adults) or len(record.minors) != len(minors):
+            return None
+        record.group_account_num = state["account"]
+        record.signed = state["signed"]
+        record.signatures = state["signatures"]
+        record.web_links = state["web_links"]
+        record.has_key = state["has_key"]
+        record.key_enabled = state["key_enabled"]
+        return record
+
+    def save_state(self, filename: str = state_filename) -> None:
+        """
+        Save the records by member id so a later run can update them.
+        Unlike the CSV files, this does not depend on matching names.
+        """
+        if not os.path.isdir(os.path.dirname(filename) or "."):
+            return
+        state = { "no_minor_children": [ RequiredWaivers.record_state(record) for record in self.no_minor_children ],
+                  "with_minor_children": [ RequiredWaivers.record_state(record) for record in self.with_minor_children ],
+                  "unknown_status": [ RequiredWaivers.record_state(record) for record in self.unknown_status ],
+                  "key_holders": self.key_holders,
+                  "doc_members": self.doc_members,
+                  "parents_hash": self.parents_hash }
+        tmp_file = filename + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, filename)
+
+    @staticmethod
+    def load_state(membership: memberdata.Membership, filename: str = state_filename) -> RequiredWaivers | None:
+        """
+        Load records saved by save_state. Records with members no longer in the
+        membership are dropped, the accounts of those members need to be updated.
+        """
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: unable to read '{filename}': {e}")
+            return None
+
+        groupings = RequiredWaivers()
+        for name in [ "no_minor_children", "with_minor_children", "unknown_status" ]:
+            records = getattr(groupings, name)
+            for record_state in state[name]:
+                record = RequiredWaivers.read_record_state(membership, record_state)
+                if record is not None:
+                    records.append(record)
+        groupings.key_holders = state["key_holders"]
+        groupings.doc_members = state["doc_members"]
+        groupings.parents_hash = state["parents_hash"]
+        groupings.index_records()
+        return groupings
  
 class MemberRecord:
     """
@@ -355,6 +586,41 @@ class MemberRecord:
 
     member_csv = "output/member_records.csv"
 
+    @staticmethod
+    def from_adult_record(adult_record: RequiredWaiver, member_keys: keys.MemberKeys) -> MemberRecord:
+        member_record = MemberRecord()
+        member_record.adults.append(adult_record.adult())
+        member_record.web_links[0] = adult_record.web_links[0]
+        member_record.signed = adult_record.signed
+        member_record.signatures[0] = adult_record.signed
+        member_record.has_key = member_keys.has_key(adult_record.adult().member_id)
+        member_record.key_enabled = member_keys.has_enabled_key(adult_record.adult().member_id)
+        return member_record
+
+    @staticmethod
+    def from_family_record(family_record: RequiredWaiver, member_keys: keys.MemberKeys) -> MemberRecord:
+        member_record = MemberRecord()
+        member_record.adults = family_record.adults.copy()
+        member_record.minors = family_record.minors.copy()
+        member_record.signed = family_record.signed
+        member_record.signatures = family_record.signatures.copy()
+        member_record.web_links = family_record.web_links.copy()
+        member_record.set_keys(member_keys)
+        return member_record
+
+    @staticmethod
+    def from_unknown_record(family_record: RequiredWaiver, member_keys: keys.MemberKeys) -> MemberRecord:
+        member_record = MemberRecord()
+        member_record.adults = family_record.adults.copy()
+        member_record.minors = family_record.minors.copy()
+        member_record.set_keys(member_keys)
+        return member_record
+
+    def set_keys(self, member_keys: keys.MemberKeys) -> None:
+        for member_id in self.get_member_ids():
+            self.has_key = self.has_key or member_keys.has_key(member_id)
+            self.key_enabled = self.key_enabled or member_keys.has_enabled_key(member_id)
+
     @staticmethod
     def gen_records(required_waivers: RequiredWaivers, member_keys: keys.MemberKeys) -> list[MemberRecord]:
         """
@@ -362,36 +628,13 @@ class MemberRecord:
         member_records: list[MemberRecord] = []
 
         for adult_record in required_waivers.no_minor_children:
-            member_record = MemberRecord()
-            member_record.adults.append(adult_record.adult())
-            member_record.web_links[0] = adult_record.web_links[0]
-            member_record.signed = adult_record.signed
-            member_record.signatures[0] = adult_record.signed
-            member_record.has_key = member_keys.has_key(adult_record.adult().member_id)
-            member_record.key_enabled = member_keys.has_enabled_key(adult_record.adult().member_id)
-            member_records.append(member_record)
+            member_records.append(MemberRecord.from_adult_record(adult_record, member_keys))
 
         for family_record in required_waivers.with_minor_children:
-            member_record = MemberRecord()
-            member_record.adults = family_record.adults.copy()
-            member_record.minors = family_record.minors.copy()
-            member_record.signed = family_record.signed
-            member_record.signatures = family_record.signatures.copy()
-            member_record.web_links = family_record.web_links.copy()
-
-            for member_id in member_record.get_member_ids():
-                member_record.has_key = member_record.has_key or member_keys.has_key(member_id)
-                member_record.key_enabled = member_record.key_enabled or member_keys.has_enabled_key(member_id)
-            member_records.append(member_record)
+            member_records.append(MemberRecord.from_family_record(family_record, member_keys))
 
         for family_record in required_waivers.unknown_status:
-            member_record = MemberRecord()
-            member_record.adults = family_record.adults.copy()
-            member_record.minors = family_record.minors.copy()
-            for member_id in member_record.get_member_ids():
-                member_record.has_key = member_record.has_key or member_keys.has_key(member_id)
-                member_record.key_enabled = member_record.key_enabled or member_keys.has_enabled_key(member_id)
-            member_records.append(member_record)
+            member_records.append(MemberRecord.from_unknown_record(family_record, member_keys))
 
         member_records.sort(key=MemberRecord.key_func)
         return member_records